@@ -0,0 +1,272 @@
+""" Batch analysis: the move and a value for each column of many positions at once.
+
+The positions can be a list of 6x7 boards, a (N, 6, 7) array of ' '/'x'/'o', a
+(N, 42) or (N, 6, 7) array of 0/1/2 (the dataset format, see dataset_io.py) or a list
+of Position. Unless to_move is given, the player to move is the one with fewer pieces
+('x' when both have the same number; see first).
+
+- analyse_dt: one vectorized pass through the compiled tree for all the positions.
+  The values are the class frequencies of the training rows in the leaf reached,
+  i.e. how often the MCTS that labelled the dataset chose each column there. The
+  moves are those of AIPlayer_DT: the opening book first (with use_book),
+  then the tree.
+- analyse_mcts: the searches of a chunk of positions run interleaved, one round at a
+  time: every search selects leaf_batch leaves (with a virtual loss), then the
+  rollouts of the leaves of all the searches are played in a single NumPy batch
+  (rollout.py). The steps are those of MCTS.search_batched, only the rollout batch
+  is shared. The chunks are searched by the persistent pool of mcts.get_pool.
+  The values are the average results (1 win, 0.5 draw, 0 loss) of the root children
+  for the player to move, or the exact ones when the solver is used.
+
+Illegal columns have the value nan, and so do finished positions, whose move is None.
+
+    python analysis.py mcts_dataset_hard.csv --model mcts:1000:1.41 --workers 4
+    python analysis.py games.txt --model dt:hard --output analysis.csv
+"""
+import csv
+import random
+import argparse
+import numpy as np
+from bitboard import Position, ROWS, COLS
+from compiled_tree import boards_to_matrix
+from dataset_io import load_dataset
+from decision_tree_model import DATASETS
+from model_store import load_compiled
+from mcts import MCTS, get_pool
+from opening_book import default_book, book_move
+
+# cell values of the int boards -> ' '/'x'/'o'
+CELLS = np.array([" ", "x", "o"])
+
+
+class Analysis(object):
+    """ Results of a batch: moves (N,) with -1 for finished positions, values (N, 7)
+    and, for the MCTS, visits (N, 7) of the root children """
+
+    def __init__(self, moves, values, visits=None):
+        self.moves = moves
+        self.values = values
+        self.visits = visits
+
+    def __len__(self):
+        return len(self.moves)
+
+    def move(self, i):
+        return None if self.moves[i] < 0 else int(self.moves[i])
+
+
+def to_positions(positions, to_move=None, first='x'):
+    """ Any of the accepted inputs -> list of Position. to_move: a color for all the
+    positions or one color per position """
+    if len(positions) and isinstance(positions[0], Position):
+        return [position.copy() for position in positions]
+    boards = np.asarray(positions)
+    if boards.dtype.kind in "iub":
+        boards = CELLS[boards.reshape(len(boards), ROWS, COLS)]
+    boards = boards.reshape(len(boards), ROWS, COLS)
+    if to_move is None or isinstance(to_move, str):
+        colors = [to_move] * len(boards)
+    else:
+        colors = list(to_move)
+    result = []
+    for board, color in zip(boards.tolist(), colors):
+        if color is None:
+            x = sum(row.count('x') for row in board)
+            o = sum(row.count('o') for row in board)
+            color = first if x == o else ('x' if x < o else 'o')
+        result.append(Position.from_board(board, color))
+    return result
+
+
+def _legal(positions):
+    """ (N, 7) bool, legal columns of the unfinished positions """
+    legal = np.zeros((len(positions), COLS), dtype=bool)
+    for i, position in enumerate(positions):
+        if position.moves < ROWS * COLS and position.result() is None:
+            legal[i, position.legal_moves()] = True
+    return legal
+
+
+def analyse_dt(positions, difficulty="hard", to_move=None, first='x', use_book=False):
+    """ Moves and column values of the DT of difficulty for all the positions.
+    With use_book the moves of the opening book come first, like in AIPlayer_DT """
+    positions = to_positions(positions, to_move, first)
+    _, compiled = _dt_model(difficulty)
+    legal = _legal(positions)
+    X = boards_to_matrix([position.to_board() for position in positions]) if positions \
+        else np.zeros((0, ROWS * COLS), dtype=np.int8)
+
+    values = np.zeros((len(positions), COLS))
+    proba = compiled.predict_proba(X)
+    columns = compiled.classes.astype(np.int64)
+    values[:, columns] = proba
+    values[~legal] = np.nan
+
+    # the move of the player: the book move, else the label of the leaf, else (a missing
+    # branch or a full column) the legal column with the highest value, like a random pick
+    # when all are 0
+    book = default_book() if use_book else None
+    moves = np.full(len(positions), -1, dtype=np.int64)
+    predicted = compiled.predict(X) if len(X) else []
+    for i, label in enumerate(predicted):
+        if not legal[i].any():
+            continue
+        move = book_move(book, positions[i])
+        if move is not None:
+            moves[i] = move
+        elif label is not None and 0 <= int(label) < COLS and legal[i, int(label)]:
+            moves[i] = int(label)
+        else:
+            moves[i] = int(np.nanargmax(values[i]))
+    return Analysis(moves, values)
+
+
+# compiled trees with their leaf counts, per difficulty (per process)
+_dt_models = {}
+
+
+def _dt_model(difficulty):
+    model = _dt_models.get(difficulty)
+    if model is None:
+        tree, compiled = load_compiled(difficulty)
+        boards, labels = load_dataset(DATASETS[difficulty])
+        compiled.count_leaves(np.asarray(boards), np.asarray(labels))
+        model = _dt_models[difficulty] = (tree, compiled)
+    return model
+
+
+def analyse_mcts(positions, iterations=1000, c=1.41, to_move=None, first='x', workers=1,
+                 leaf_batch=8, rollouts_per_leaf=1, solver_threshold=0, seed=None):
+    """ Moves, column values and root visits of an MCTS search of iterations for each position """
+    positions = to_positions(positions, to_move, first)
+    if seed is None:
+        seed = random.getrandbits(32)
+    options = {"exploration_constant": c, "leaf_batch": leaf_batch,
+               "rollouts_per_leaf": rollouts_per_leaf, "solver_threshold": solver_threshold}
+    if workers == 1 or len(positions) < 2:
+        return Analysis(*_search_chunk(positions, iterations, options, seed))
+    # a few chunks per worker, so a slow chunk does not leave the others idle at the end
+    n_chunks = min(len(positions), workers * 4)
+    bounds = np.linspace(0, len(positions), n_chunks + 1).astype(int)
+    chunks = [positions[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    pool = get_pool(workers)
+    results = list(pool.map(_search_chunk, chunks, [iterations] * n_chunks, [options] * n_chunks,
+                            [seed + i for i in range(n_chunks)]))
+    return Analysis(*(np.concatenate(parts) for parts in zip(*results)))
+
+
+def _search_chunk(positions, iterations, options, seed):
+    """ Runs in a worker (or in-process): the interleaved searches of positions.
+    Returns (moves, values, visits) """
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    mc = MCTS(None, iterations, **options)
+    n = len(positions)
+    moves = np.full(n, -1, dtype=np.int64)
+    values = np.full((n, COLS), np.nan)
+    visits = np.zeros((n, COLS), dtype=np.int64)
+
+    searches = []
+    for i, position in enumerate(positions):
+        if position.moves == ROWS * COLS or position.result() is not None:
+            continue
+        if mc.solver is not None and ROWS * COLS - position.moves <= mc.solver_threshold:
+            moves[i] = _solve(mc.solver, position, values[i])
+            continue
+        player = position.color
+        root = mc.Node(position, player=MCTS.other_player(player))
+        searches.append([i, root, position, player, iterations])
+
+    # [index, root, position, player, iterations left]; every round each search selects its
+    # leaves (MCTS.select_leaves), and the rollouts of all of them are played in one batch
+    mc.rng = rng
+    running = searches
+    while running:
+        rounds = []
+        for search in running:
+            _, root, position, _, remaining = search
+            leaves = mc.select_leaves(root, position, None, min(mc.leaf_batch, remaining))
+            search[4] -= len(leaves)
+            rounds.append((search, leaves))
+        scores = iter(mc.rollout_scores([leaf for _, leaves in rounds
+                                         for _, leaf, result in leaves if result is None]))
+        for search, leaves in rounds:
+            mc.backpropagate_leaves(leaves, search[3], scores)
+        running = [search for search in running if search[4] > 0 and search[1].proven is None]
+
+    for i, root, _, _, _ in searches:
+        for move, child in zip(root.child_moves, root.children):
+            visits[i, move] = child.visits
+            values[i, move] = child.wins / child.visits if child.visits else np.nan
+            if child.proven is not None:
+                values[i, move] = (child.proven + 1) / 2
+        move = mc.proven_best_move(root) if mc.solver is not None else None
+        if move is None:
+            move = root.child_moves[int(np.argmax([child.visits for child in root.children]))]
+        moves[i] = move
+    return moves, values, visits
+
+
+def _solve(solver, position, values):
+    """ Exact values (1 win, 0.5 draw, 0 loss) of every legal column; returns the best move """
+    for col in position.legal_moves():
+        position.play(col)
+        value = 1 if position.last_move_won() else -solver.solve(position)
+        position.undo()
+        values[col] = (value + 1) / 2
+    return solver.best_move(position)[0]
+
+
+def read_positions(path):
+    """ A dataset CSV (the 42 cells and a label) or a text file with one game per line,
+    given as the columns played from the empty board ('x' first), like "3344251" """
+    if path.endswith(".csv"):
+        boards, _ = load_dataset(path)
+        return to_positions(np.asarray(boards))
+    positions = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                position = Position()
+                for col in line:
+                    position.play(int(col))
+                positions.append(position)
+    return positions
+
+
+if __name__ == "__main__":
+    import time
+    from arena import parse_agent
+
+    parser = argparse.ArgumentParser(description="Move and column values of many positions")
+    parser.add_argument("positions", help="dataset CSV or text file with one move sequence per line")
+    parser.add_argument("--model", default="dt:hard", help="dt:DIFFICULTY or mcts:ITERATIONS:C")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--leaf-batch", type=int, default=8)
+    parser.add_argument("--rollouts-per-leaf", type=int, default=1)
+    parser.add_argument("--solver-threshold", type=int, default=0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="CSV with the move and the 7 values of each position")
+    args = parser.parse_args()
+
+    positions = read_positions(args.positions)
+    agent = parse_agent(args.model)
+    start = time.perf_counter()
+    if agent.kind == "dt":
+        analysis = analyse_dt(positions, agent.options["difficulty"])
+    else:
+        analysis = analyse_mcts(positions, agent.options["iterations"], agent.options["c"],
+                                workers=args.workers, leaf_batch=args.leaf_batch,
+                                rollouts_per_leaf=args.rollouts_per_leaf,
+                                solver_threshold=args.solver_threshold, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{len(analysis)} positions in {elapsed:.2f} s ({len(analysis) / elapsed:.1f}/s)")
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["move"] + [f"value_{col}" for col in range(COLS)])
+            for i in range(len(analysis)):
+                writer.writerow([analysis.move(i)] + [f"{v:.4f}" for v in analysis.values[i]])
+        print(f"written to {args.output}")
@@ -0,0 +1,173 @@
+""" Headless tournaments between the AI players.
+
+Runs many games between two agents in worker processes, with no printing and no
+screen clearing. The agents swap colors (and who starts) every game, and game i
+seeds the random module with seed + i, so a run can be repeated (searches limited by
+time instead of iterations are not repeatable). Reports wins/draws/losses, the Elo
+difference with a confidence interval and the average time per move of each agent.
+
+    python arena.py mcts:1000:1.41 dt:hard --games 200 --workers 4
+"""
+import math
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from connect4 import Game, AIPlayer_MCTS, AIPlayer_DT
+
+COLORS = ("x", "o")
+
+
+class Agent(object):
+    """ Description of an AI player (picklable, the player itself is created in the worker).
+    kind is 'mcts' (options: iterations, c and the other AIPlayer_MCTS arguments)
+    or 'dt' (options: difficulty) """
+
+    def __init__(self, name, kind, **options):
+        self.name = name
+        self.kind = kind
+        self.options = options
+
+    def make(self, color):
+        if self.kind == "mcts":
+            options = dict(self.options)
+            return AIPlayer_MCTS(self.name, color, options.pop("iterations"), options.pop("c"), **options)
+        if self.kind == "dt":
+            return AIPlayer_DT(self.name, color, self.options["difficulty"])
+        raise ValueError(f"Unknown agent kind: {self.kind}")
+
+    def __repr__(self):
+        return f"Agent({self.name!r}, {self.kind!r}, {self.options})"
+
+
+def parse_agent(text):
+    """ 'mcts:ITERATIONS:C' or 'dt:DIFFICULTY' -> Agent """
+    parts = text.split(":")
+    if parts[0] == "mcts" and len(parts) == 3:
+        return Agent(text, "mcts", iterations=int(parts[1]), c=float(parts[2]))
+    if parts[0] == "dt" and len(parts) == 2:
+        return Agent(text, "dt", difficulty=parts[1])
+    raise ValueError(f"Agent must be mcts:ITERATIONS:C or dt:DIFFICULTY, not {text!r}")
+
+
+def play_game(agent_a, agent_b, a_first, seed):
+    """ Plays one silent game. The first player is 'x'.
+    Returns (result for a: 1 win, 0.5 draw, 0 loss, number of moves,
+    [seconds of a's moves, number of a's moves], same for b) """
+    random.seed(seed)
+    first, second = (agent_a, agent_b) if a_first else (agent_b, agent_a)
+    game = Game(silent=True)
+    game.players = [first.make(COLORS[0]), second.make(COLORS[1])]
+    game.newGame()
+    player_a = game.players[0 if a_first else 1]
+    times = {id(p): [0.0, 0] for p in game.players}
+
+    while not game.finished:
+        player = game.turn
+        start = time.perf_counter()
+        game.nextMove(silent=True)
+        spent = times[id(player)]
+        spent[0] += time.perf_counter() - start
+        spent[1] += 1
+
+    if game.winner is None:
+        result = 0.5
+    else:
+        result = 1.0 if game.winner is player_a else 0.0
+    player_b = game.players[1] if a_first else game.players[0]
+    return result, game.position.moves, times[id(player_a)], times[id(player_b)]
+
+
+def elo_difference(score):
+    """ Elo difference that gives this expected score (infinite for a score of 0 or 1) """
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1) + 0.0  # + 0.0: no -0 for an even score
+
+
+def wilson_interval(score, n, z=1.96):
+    """ Wilson score interval of a mean score of n games (a draw counts as half a win).
+    Unlike the normal approximation it does not shrink to nothing at a score of 0 or 1 """
+    z2 = z * z
+    center = (score + z2 / (2 * n)) / (1 + z2 / n)
+    margin = z / (1 + z2 / n) * math.sqrt(score * (1 - score) / n + z2 / (4 * n * n))
+    # exact ends when the score is 0 or 1 (center + margin is then 1 only up to rounding)
+    low = 0.0 if score <= 0 else max(0.0, center - margin)
+    high = 1.0 if score >= 1 else min(1.0, center + margin)
+    return low, high
+
+
+class ArenaResult(object):
+    """ Results of a match, from the point of view of agent a """
+
+    def __init__(self, agent_a, agent_b, games, seconds):
+        self.agent_a = agent_a
+        self.agent_b = agent_b
+        self.results = [g[0] for g in games]
+        self.moves = sum(g[1] for g in games)
+        self.wins = self.results.count(1.0)
+        self.draws = self.results.count(0.5)
+        self.losses = self.results.count(0.0)
+        time_a = [sum(g[2][i] for g in games) for i in range(2)]
+        time_b = [sum(g[3][i] for g in games) for i in range(2)]
+        self.ms_per_move_a = 1000 * time_a[0] / max(1, time_a[1])
+        self.ms_per_move_b = 1000 * time_b[0] / max(1, time_b[1])
+        self.seconds = seconds
+
+    @property
+    def games(self):
+        return len(self.results)
+
+    def score(self):
+        return sum(self.results) / self.games if self.games else 0.5
+
+    def elo(self, z=1.96):
+        """ (Elo of a - Elo of b, low, high); the interval is the Wilson interval of the
+        score (z=1.96: 95%) converted to Elo. A score of 0 or 1 gives an infinite end """
+        n = self.games
+        s = self.score()
+        if n == 0:
+            return 0.0, -math.inf, math.inf
+        low, high = wilson_interval(s, n, z)
+        return elo_difference(s), elo_difference(low), elo_difference(high)
+
+    def report(self):
+        elo, low, high = self.elo()
+        return "\n".join([
+            f"{self.agent_a.name} vs {self.agent_b.name}: {self.games} games in {self.seconds:.1f} s",
+            f"W/D/L (for {self.agent_a.name}): {self.wins}/{self.draws}/{self.losses}"
+            f"  score {self.score():.3f}",
+            f"Elo difference: {elo:+.0f} (95% CI {low:+.0f} to {high:+.0f})",
+            f"ms per move: {self.agent_a.name} {self.ms_per_move_a:.2f},"
+            f" {self.agent_b.name} {self.ms_per_move_b:.2f}",
+            f"average game length: {self.moves / max(1, self.games):.1f} moves",
+        ])
+
+
+def run_match(agent_a, agent_b, games=100, workers=None, seed=0):
+    """ Plays the games (agent a starts the even ones) over a process pool.
+    workers=1 plays them in this process """
+    jobs = [(agent_a, agent_b, i % 2 == 0, seed + i) for i in range(games)]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [play_game(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(play_game, *zip(*jobs), chunksize=max(1, games // 64)))
+    return ArenaResult(agent_a, agent_b, results, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless games between two AI players")
+    parser.add_argument("agent_a", help="mcts:ITERATIONS:C or dt:DIFFICULTY")
+    parser.add_argument("agent_b", help="mcts:ITERATIONS:C or dt:DIFFICULTY")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = run_match(parse_agent(args.agent_a), parse_agent(args.agent_b),
+                       args.games, args.workers, args.seed)
+    print(result.report())
@@ -0,0 +1,216 @@
+""" Performance benchmarks with regression checks.
+
+Measures the hot paths (MCTS search speed on fixed positions, the list-board helpers,
+tree training, DT prediction and whole games), writes the numbers to a JSON file and
+compares them with a stored baseline:
+
+    python benchmark.py --save-baseline             # on the reference version
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.1 \\
+                        --threshold mcts_endgame_tree_iterations_per_s=0.2
+
+A metric regresses when it is worse than the baseline by more than its threshold
+(relative: 0.1 = 10%); the exit code is then 1. Each number is the best of a few
+repeats, to reduce the noise of the machine.
+"""
+import sys
+import json
+import time
+import random
+import timeit
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+from bitboard import Position
+from mcts import MCTS
+import decision_tree_model
+from compiled_tree import compile_tree
+from dataset_io import load_dataset
+from arena import Agent, play_game
+
+BASELINE = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.10
+
+# fixed positions (columns played from the empty board, 'x' first), none of them finished
+POSITIONS = {
+    "opening": "21",
+    "midgame": "3500640240410044",
+    "endgame": "501335250012115453025632231001",
+}
+
+# search modes of the MCTS benchmark: name -> MCTS arguments
+MCTS_MODES = {
+    "tree": {},
+    "compact": {"compact": True},
+    # 1024 games per call of the rollout kernel, which has a fixed cost of about 1.5 ms
+    "batched": {"rollouts_per_leaf": 16, "leaf_batch": 64},
+}
+
+
+def position_from_moves(moves):
+    position = Position()
+    for col in moves:
+        position.play(int(col))
+    return position
+
+
+def metric(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def best_time(function, repeat):
+    """ Shortest of repeat runs, in seconds """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_mcts(results, iterations, repeat):
+    """ Iterations and rollouts per second of bestMove on each fixed position """
+    for phase, moves in POSITIONS.items():
+        position = position_from_moves(moves)
+        for mode, options in MCTS_MODES.items():
+            best = 0.0
+            for i in range(repeat):
+                random.seed(i)
+                mc = MCTS(None, iterations, 1.41, **options)
+                start = time.perf_counter()
+                mc.bestMove(position, position.color)
+                best = max(best, mc.last_iterations / (time.perf_counter() - start))
+            name = f"mcts_{phase}_{mode}"
+            results[name + "_iterations_per_s"] = metric(best, "iterations/s", True)
+            # every iteration that does not end on a finished position does rollouts_per_leaf games
+            results[name + "_rollouts_per_s"] = metric(best * options.get("rollouts_per_leaf", 1),
+                                                       "rollouts/s", True)
+
+
+def bench_helpers(results, number):
+    """ Time per call of the list-board helpers of MCTS """
+    board = position_from_moves(POSITIONS["midgame"]).to_board()
+    for name, call in (("game_result", lambda: MCTS.game_result(board)),
+                       ("make_move", lambda: MCTS.make_move(board, 3, 'x'))):
+        seconds = min(timeit.repeat(call, number=number, repeat=5)) / number
+        results[f"{name}_us"] = metric(seconds * 1e6, "us/call", False)
+
+
+def bench_training(results, repeat):
+    """ Wall time and peak of the memory allocated by train_tree, per difficulty """
+    for difficulty in decision_tree_model.DATASETS:
+        results[f"train_tree_{difficulty}_s"] = metric(
+            best_time(lambda: decision_tree_model.train_tree(difficulty), repeat), "s", False)
+        tracemalloc.start()
+        decision_tree_model.train_tree(difficulty)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[f"train_tree_{difficulty}_peak_mb"] = metric(peak / 2 ** 20, "MB", False)
+
+
+def bench_prediction(results, number):
+    """ predict_from_tree latency for one board, and per board in a batch """
+    tree = decision_tree_model.train_tree("hard")
+    compiled = compile_tree(tree, canonical=decision_tree_model.CANONICAL)
+    board = position_from_moves(POSITIONS["midgame"]).to_board()
+    decision_tree_model.predict_from_tree(tree, board)
+    seconds = min(timeit.repeat(lambda: decision_tree_model.predict_from_tree(tree, board),
+                                number=number, repeat=5)) / number
+    results["predict_from_tree_us"] = metric(seconds * 1e6, "us/call", False)
+    X = np.asarray(load_dataset(decision_tree_model.DATASETS["hard"])[0])
+    seconds = best_time(lambda: compiled.predict(X), 5) / len(X)
+    results["predict_batch_us_per_board"] = metric(seconds * 1e6, "us/board", False)
+
+
+def bench_games(results, games):
+    """ Whole silent games per second """
+    matches = {"mcts50_vs_mcts50": (Agent("a", "mcts", iterations=50, c=2), Agent("b", "mcts", iterations=50, c=2)),
+               "dt_vs_dt": (Agent("a", "dt", difficulty="hard"), Agent("b", "dt", difficulty="medium"))}
+    for name, (a, b) in matches.items():
+        play_game(a, b, True, 0)  # loads the trees of the DT players
+        start = time.perf_counter()
+        for i in range(games):
+            play_game(a, b, i % 2 == 0, i)
+        results[f"games_{name}_per_s"] = metric(games / (time.perf_counter() - start), "games/s", True)
+
+
+def run(quick=False):
+    """ Runs every benchmark, returns the JSON document """
+    repeat = 2 if quick else 3
+    results = {}
+    bench_mcts(results, 300 if quick else 2000, repeat)
+    bench_helpers(results, 2000 if quick else 20000)
+    bench_training(results, 1 if quick else repeat)
+    bench_prediction(results, 2000 if quick else 20000)
+    bench_games(results, 4 if quick else 20)
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "quick": quick,
+                     "python": platform.python_version(), "numpy": np.__version__,
+                     "machine": platform.machine(), "processor": platform.processor()},
+            "results": results}
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD, thresholds=None):
+    """ Returns [(name, baseline value, current value, relative change, regressed)] for the
+    metrics in both; the change is positive when the metric got better """
+    thresholds = thresholds or {}
+    rows = []
+    for name, old in baseline["results"].items():
+        new = current["results"].get(name)
+        if new is None or not old["value"]:
+            continue
+        change = (new["value"] - old["value"]) / old["value"]
+        if not old["higher_is_better"]:
+            change = -change
+        rows.append((name, old["value"], new["value"], change, change < -thresholds.get(name, threshold)))
+    return rows
+
+
+def print_comparison(rows):
+    for name, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<45} {old:>12.4g} {new:>12.4g} {change:>+8.1%} {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {BASELINE}")
+    parser.add_argument("--threshold", action="append", default=[],
+                        help="allowed relative regression: a number for all metrics, or NAME=NUMBER")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and repeats")
+    args = parser.parse_args()
+
+    threshold = DEFAULT_THRESHOLD
+    thresholds = {}
+    for value in args.threshold:
+        if "=" in value:
+            name, value = value.split("=", 1)
+            thresholds[name] = float(value)
+        else:
+            threshold = float(value)
+
+    current = run(args.quick)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline is None:
+        for name, m in current["results"].items():
+            print(f"{name:<45} {m['value']:>12.4g} {m['unit']}")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, threshold, thresholds)
+    print_comparison(rows)
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+""" Bitboard representation of a Connect 4 position.
+
+Each column uses 7 bits (6 rows + 1 empty sentinel bit on top), so the bit of
+the cell (row, col) is col * 7 + row, with row 0 being the bottom row (the same
+as board[0] in the list-of-lists board used by Game).
+The sentinel bit stops the shifts used in the win check from wrapping around
+from one column to the next.
+"""
+
+ROWS = 6
+COLS = 7
+H1 = ROWS + 1  # bits per column
+
+COLORS = ('x', 'o')
+COLOR_INDEX = {'x': 0, 'o': 1}
+
+COLUMN_MASK = (1 << H1) - 1  # the bits of column 0
+BOTTOM_MASK = sum(1 << (col * H1) for col in range(COLS))
+BOARD_MASK = BOTTOM_MASK * ((1 << ROWS) - 1)
+TOP_MASKS = [1 << (ROWS - 1 + col * H1) for col in range(COLS)]
+
+# shifts for the 4 directions: vertical, horizontal and the two diagonals
+DIRECTIONS = (1, H1, H1 - 1, H1 + 1)
+
+
+def _windows_through(col, row):
+    """ Masks of every 4-cell line that contains (row, col) and can be completed by
+    a piece just dropped there: for the vertical only the one going down from it """
+    windows = []
+    if row >= 3:
+        windows.append(sum(1 << (col * H1 + row - k) for k in range(4)))
+    for d_col, d_row in ((1, 0), (1, 1), (1, -1)):
+        for start in range(-3, 1):
+            cells = [(col + (start + k) * d_col, row + (start + k) * d_row) for k in range(4)]
+            if all(0 <= c < COLS and 0 <= r < ROWS for c, r in cells):
+                windows.append(sum(1 << (c * H1 + r) for c, r in cells))
+    return tuple(windows)
+
+
+# WINDOWS[bit] -> lines through that cell, so a win check after a move only looks at these
+WINDOWS = [()] * (COLS * H1)
+for _col in range(COLS):
+    for _row in range(ROWS):
+        WINDOWS[_col * H1 + _row] = _windows_through(_col, _row)
+
+
+def is_win(mask):
+    """ Returns True if the pieces in mask have 4 in a row anywhere """
+    for shift in DIRECTIONS:
+        m = mask & (mask >> shift)
+        if m & (m >> (2 * shift)):
+            return True
+    return False
+
+
+def mirror_mask(mask):
+    """ The mask (or key) of the position reflected left-right: column c goes to COLS - 1 - c """
+    mirrored = 0
+    for col in range(COLS):
+        mirrored |= ((mask >> (col * H1)) & COLUMN_MASK) << ((COLS - 1 - col) * H1)
+    return mirrored
+
+
+def mirror_move(col):
+    """ The column of the mirror image that matches col """
+    return COLS - 1 - col
+
+
+class Position(object):
+    """ Connect 4 position: one bitmask per color plus the height of each column.
+
+    masks[0] holds the pieces of 'x' and masks[1] the pieces of 'o'.
+    heights[col] is the bit index where the next piece of that column goes.
+    to_move is the index (in COLORS) of the player that plays next.
+    """
+
+    __slots__ = ('masks', 'heights', 'to_move', 'moves', 'history')
+
+    def __init__(self, first='x'):
+        self.masks = [0, 0]
+        self.heights = [col * H1 for col in range(COLS)]
+        self.to_move = COLOR_INDEX[first]
+        self.moves = 0
+        self.history = []
+
+    @classmethod
+    def from_board(cls, board, to_move='x'):
+        """ Builds a position from a 6x7 board of ' ', 'x' and 'o' """
+        position = cls(to_move)
+        for col in range(COLS):
+            for row in range(ROWS):
+                index = COLOR_INDEX.get(board[row][col])
+                if index is None:
+                    break
+                position.masks[index] |= 1 << position.heights[col]
+                position.heights[col] += 1
+                position.moves += 1
+        return position
+
+    def to_board(self):
+        """ Returns the 6x7 list-of-lists board used by Game and the players """
+        board = [[' ' for _ in range(COLS)] for _ in range(ROWS)]
+        for row in range(ROWS):
+            for col in range(COLS):
+                bit = 1 << (col * H1 + row)
+                if self.masks[0] & bit:
+                    board[row][col] = COLORS[0]
+                elif self.masks[1] & bit:
+                    board[row][col] = COLORS[1]
+        return board
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.masks = self.masks[:]
+        position.heights = self.heights[:]
+        position.to_move = self.to_move
+        position.moves = self.moves
+        position.history = self.history[:]
+        return position
+
+    def mirror(self):
+        """ The position reflected left-right (the history is mirrored too) """
+        position = Position.__new__(Position)
+        position.masks = [mirror_mask(mask) for mask in self.masks]
+        position.heights = [self.heights[COLS - 1 - col] + (2 * col - COLS + 1) * H1 for col in range(COLS)]
+        position.to_move = self.to_move
+        position.moves = self.moves
+        position.history = [COLS - 1 - col for col in self.history]
+        return position
+
+    @property
+    def color(self):
+        """ Color ('x' or 'o') of the player to move """
+        return COLORS[self.to_move]
+
+    def height(self, col):
+        """ Row where the next piece of column col goes """
+        return self.heights[col] - col * H1
+
+    def can_play(self, col):
+        return self.heights[col] - col * H1 < ROWS
+
+    def legal_moves(self):
+        """ Returns a list of not full columns """
+        return [col for col in range(COLS) if self.heights[col] - col * H1 < ROWS]
+
+    def play(self, col):
+        """ Drops a piece of the player to move in column col """
+        self.masks[self.to_move] |= 1 << self.heights[col]
+        self.heights[col] += 1
+        self.to_move ^= 1
+        self.moves += 1
+        self.history.append(col)
+
+    def undo(self):
+        """ Takes back the last move played with play() """
+        col = self.history.pop()
+        self.heights[col] -= 1
+        self.to_move ^= 1
+        self.moves -= 1
+        self.masks[self.to_move] ^= 1 << self.heights[col]
+
+    def key(self):
+        """ Unique integer for the position: pieces of the player to move + all the pieces.
+        Adding the bottom row makes the column heights part of the key """
+        return self.masks[self.to_move] + (self.masks[0] | self.masks[1]) + BOTTOM_MASK
+
+    def canonical_key(self):
+        """ (key, mirrored): the smaller of key() and the key of the mirrored position, and
+        True if it is the mirrored one (then a column c of this position is COLS - 1 - c there).
+        A position and its mirror image get the same key """
+        key = self.key()
+        mirrored = mirror_mask(key)
+        if mirrored < key:
+            return mirrored, True
+        return key, False
+
+    def is_symmetric(self):
+        """ True if the position is its own mirror image (then col and COLS - 1 - col are the same move) """
+        key = self.key()
+        return mirror_mask(key) == key
+
+    def winning_moves(self, side=None):
+        """ Columns where side (by default the player to move) would make 4 in a row """
+        if side is None:
+            side = self.to_move
+        mask = self.masks[side]
+        moves = []
+        for col in range(COLS):
+            bit_index = self.heights[col]
+            if bit_index - col * H1 < ROWS:
+                m = mask | (1 << bit_index)
+                for window in WINDOWS[bit_index]:
+                    if m & window == window:
+                        moves.append(col)
+                        break
+        return moves
+
+    def last_move_won(self):
+        """ True if the last move played made 4 in a row.
+        Only the lines through the last piece are checked """
+        if not self.history:
+            return self.winner() is not None
+        mask = self.masks[self.to_move ^ 1]
+        for window in WINDOWS[self.heights[self.history[-1]] - 1]:
+            if mask & window == window:
+                return True
+        return False
+
+    def last_move_result(self):
+        """ Like result(), but only checks the last move and uses the move counter for draws.
+        Valid as long as the position was not already finished before that move """
+        if self.last_move_won():
+            return COLORS[self.to_move ^ 1]
+        if self.moves == ROWS * COLS:
+            return 'draw'
+        return None
+
+    def winner(self):
+        """ Returns 'x' or 'o' if that player has 4 in a row, None otherwise """
+        if is_win(self.masks[0]):
+            return COLORS[0]
+        if is_win(self.masks[1]):
+            return COLORS[1]
+        return None
+
+    def result(self):
+        """ Same convention as MCTS.game_result: 'x', 'o', 'draw' or None """
+        winner = self.winner()
+        if winner is not None:
+            return winner
+        if self.moves == ROWS * COLS:
+            return 'draw'
+        return None
@@ -0,0 +1,72 @@
+""" Time management for the MCTS players.
+
+The search can run for a fixed time per move (MCTS time_limit_ms) or share a clock
+for the whole game (GameClock), which gives more time to the critical midgame
+positions and less to forced or almost finished ones.
+"""
+import time
+from bitboard import ROWS, COLS
+
+
+def forced_move(position):
+    """ Returns the column to play if there is no choice to make, else None:
+    a winning move, the only legal move, or the only block of an immediate loss """
+    legal = position.legal_moves()
+    if len(legal) == 1:
+        return legal[0]
+    wins = position.winning_moves()
+    if wins:
+        return wins[0]
+    threats = position.winning_moves(position.to_move ^ 1)
+    if len(threats) == 1:
+        return threats[0]
+    return None
+
+
+class GameClock(object):
+    """ Total time (ms) for all the moves of one player in a game, plus an optional
+    increment per move. budget() says how long the next search may take """
+
+    # weight of each phase of the game in the time split
+    OPENING_WEIGHT = 0.7
+    MIDGAME_WEIGHT = 1.5
+    ENDGAME_WEIGHT = 0.6
+
+    def __init__(self, total_ms, increment_ms=0, reserve_ms=50):
+        self.total_ms = total_ms
+        self.increment_ms = increment_ms
+        self.reserve_ms = reserve_ms  # never planned, covers the overhead of each move
+        self.reset()
+
+    def reset(self):
+        """ Starts the clock of a new game """
+        self.remaining_ms = self.total_ms
+        self.started = None
+
+    def budget(self, position):
+        """ Milliseconds for the search of the next move of this position """
+        if forced_move(position) is not None:
+            return 0
+        empty = ROWS * COLS - position.moves
+        # our moves left, if the game goes to the end
+        moves_left = max(1, (empty + 1) // 2)
+        if position.moves < 8:
+            weight = self.OPENING_WEIGHT
+        elif empty > 12:
+            weight = self.MIDGAME_WEIGHT
+        else:
+            weight = self.ENDGAME_WEIGHT
+        available = max(0, self.remaining_ms - self.reserve_ms)
+        budget = available / moves_left * weight + self.increment_ms
+        # never more than half of what is left, there must always be time for the rest
+        return min(budget, available / 2)
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        """ Charges the time since start() to the clock, returns it in ms """
+        spent = (time.perf_counter() - self.started) * 1000
+        self.remaining_ms += self.increment_ms - spent
+        self.started = None
+        return spent
@@ -0,0 +1,256 @@
+""" Compiled decision trees: the nested dict built by build_tree_two_thresholds turned
+into flat arrays, so a prediction is a few array lookups per level instead of
+parsing the branch strings ('<= 0.5', '(0.5, 1.5]', '> 1.5') at every node.
+
+A tree trained on canonical boards (see canonical_matrix: a board and its mirror image
+are the same row, the label mirrored with it) is compiled with canonical=True; the
+boards are then put in canonical form before the prediction and the predicted column
+is mirrored back.
+"""
+import numpy as np
+
+CELL_FEATURES = [f"cell_{i}" for i in range(42)]
+CELL_MAPPING = {" ": 0, "x": 1, "o": 2}
+
+NO_CHILD = -1
+
+COLS = 7
+# MIRROR[i]: cell of the mirror image that matches cell i (row by row, 7 cells per row)
+MIRROR = np.array([row * COLS + COLS - 1 - col for row in range(6) for col in range(COLS)])
+
+
+def board_features(board):
+    """ 6x7 board -> the 42 cell values (0 empty, 1 'x', 2 'o') used by the trees """
+    return [CELL_MAPPING.get(cell.strip(), 0) for row in board for cell in row]
+
+
+def boards_to_matrix(boards):
+    """ List of boards or a (N, 6, 7) array of ' '/'x'/'o' -> (N, 42) int8 matrix """
+    boards = np.asarray(boards)
+    matrix = np.zeros(boards.shape[:1] + (42,), dtype=np.int8)
+    flat = boards.reshape(len(boards), 42)
+    matrix[flat == 'x'] = 1
+    matrix[flat == 'o'] = 2
+    return matrix
+
+
+def canonical_matrix(X):
+    """ (N, 42) cell matrix -> (canonical matrix, mirrored): each row is replaced by its
+    mirror image when that one is smaller (compared cell by cell), mirrored says which ones """
+    X = np.asarray(X)
+    mirrored_X = X[:, MIRROR]
+    diff = X != mirrored_X
+    first = diff.argmax(axis=1)
+    rows = np.arange(len(X))
+    mirrored = diff.any(axis=1) & (mirrored_X[rows, first] < X[rows, first])
+    return np.where(mirrored[:, None], mirrored_X, X), mirrored
+
+
+def canonical_labels(X, y, mirrored):
+    """ Columns y of the rows of X, for their canonical form: mirrored where the board was.
+    On a symmetric board a column and its mirror are the same move, the smaller one is kept """
+    y = np.asarray(y)
+    mirror_y = COLS - 1 - y
+    symmetric = (X == X[:, MIRROR]).all(axis=1)
+    y = np.where(mirrored, mirror_y, y)
+    return np.where(symmetric, np.minimum(y, mirror_y), y).astype(y.dtype)
+
+
+def canonical_dataset(X, y):
+    """ Canonical form of a dataset (X, y), with the rows that become duplicates of an
+    earlier one (a mirror image with the mirrored label) removed """
+    X, mirrored = canonical_matrix(X)
+    y = canonical_labels(X, y, mirrored)
+    _, first = np.unique(np.column_stack([X, y]), axis=0, return_index=True)
+    keep = np.sort(first)
+    return X[keep], y[keep]
+
+
+def _parse_branch(key):
+    """ Branch key -> (index of the branch, thresholds in it) """
+    if key.startswith('<='):
+        return 0, (float(key.split('<= ')[1]),)
+    if key.startswith('('):
+        t1, t2 = key.strip('()[]').split(', ')
+        return 1, (float(t1), float(t2))
+    return 2, (float(key.split('> ')[1].strip(']')),)
+
+
+class CompiledTree(object):
+    """
+    Node i is an internal node if feature[i] >= 0: the branch taken is
+    (x[feature[i]] > t1[i]) + (x[feature[i]] > t2[i]), i.e. 0 for '<= t1', 1 for '(t1, t2]'
+    and 2 for '> t2' (two-way nodes have t1 == t2 and no middle child), and the next node
+    is children[i][branch]. Leaves have feature[i] == -1 and predict labels[leaf[i]].
+    """
+
+    def __init__(self, features, feature, t1, t2, children, leaf, labels, canonical=False):
+        self.features = list(features)
+        # trained on canonical boards: the inputs are made canonical and the columns mirrored back
+        self.canonical = canonical
+        # plain lists for the one-board path, arrays for the batch path
+        self.feature_list = list(feature)
+        self.t1_list = list(t1)
+        self.t2_list = list(t2)
+        self.children_list = [tuple(c) for c in children]
+        self.leaf_list = list(leaf)
+        self.labels = list(labels)
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.t1 = np.asarray(t1, dtype=np.float64)
+        self.t2 = np.asarray(t2, dtype=np.float64)
+        self.children = np.asarray(children, dtype=np.int32).reshape(-1, 3)
+        self.leaf = np.asarray(leaf, dtype=np.int32)
+        # class counts of each node, set by count_leaves
+        self.classes = None
+        self.leaf_counts = None
+
+    def __len__(self):
+        return len(self.feature_list)
+
+    def predict_one(self, x):
+        """ x: the feature values, in the order of self.features """
+        if isinstance(x, np.ndarray):
+            x = x.tolist()
+        if self.canonical:
+            mirrored_x = [x[i] for i in MIRROR]
+            if mirrored_x < x:
+                label = self._predict_one(mirrored_x)
+                return None if label is None else COLS - 1 - label
+        return self._predict_one(x)
+
+    def _predict_one(self, x):
+        node = 0
+        feature = self.feature_list
+        t1 = self.t1_list
+        t2 = self.t2_list
+        children = self.children_list
+        while feature[node] >= 0:
+            v = x[feature[node]]
+            node = children[node][(v > t1[node]) + (v > t2[node])]
+            if node == NO_CHILD:
+                # like classify: no branch matched
+                return None
+        return self.labels[self.leaf_list[node]]
+
+    def predict_board(self, board):
+        return self.predict_one(board_features(board))
+
+    def leaf_indices(self, X):
+        """ Index of the leaf reached by each row of X (NO_CHILD if no branch matched) """
+        X = np.asarray(X)
+        node = np.zeros(len(X), dtype=np.int64)
+        active = np.flatnonzero(self.feature[node] >= 0)
+        while active.size:
+            current = node[active]
+            f = self.feature[current]
+            v = X[active, f]
+            branch = (v > self.t1[current]).astype(np.int64) + (v > self.t2[current])
+            nxt = self.children[current, branch]
+            node[active] = nxt
+            # rows that reached a leaf (or a missing branch) stop here
+            keep = nxt >= 0
+            keep[keep] = self.feature[nxt[keep]] >= 0
+            active = active[keep]
+        return node
+
+    def predict(self, X):
+        """ X: (N, n_features) matrix -> array with the predicted label of each row """
+        if self.canonical:
+            X, mirrored = canonical_matrix(X)
+            predicted = self._predict(X)
+            if mirrored.any():
+                if predicted.dtype == object:
+                    predicted[mirrored] = [None if label is None else COLS - 1 - label
+                                           for label in predicted[mirrored]]
+                else:
+                    predicted[mirrored] = COLS - 1 - predicted[mirrored]
+            return predicted
+        return self._predict(X)
+
+    def _predict(self, X):
+        node = self.leaf_indices(X)
+        labels = np.asarray(self.labels + [None], dtype=object)
+        index = np.where(node >= 0, self.leaf[np.maximum(node, 0)], len(self.labels))
+        predicted = labels[index]
+        if (index < len(self.labels)).all():
+            # all rows matched a leaf: use the natural dtype of the labels
+            return np.asarray(predicted.tolist())
+        return predicted
+
+    def predict_boards(self, boards):
+        return self.predict(boards_to_matrix(boards))
+
+    def count_leaves(self, X, y):
+        """ Counts the classes of the rows (X, y) reaching each node, usually the training
+        data: the leaves only keep their majority label. Sets self.classes and
+        self.leaf_counts, (number of nodes, number of classes) """
+        if self.canonical:
+            X, mirrored = canonical_matrix(X)
+            y = canonical_labels(X, y, mirrored)
+        node = self.leaf_indices(X)
+        y = np.asarray(y)
+        self.classes, y_index = np.unique(y, return_inverse=True)
+        if self.canonical:
+            # every column, so that a mirrored row can be mapped back
+            self.classes = np.arange(COLS, dtype=y.dtype)
+            y_index = y.astype(np.int64)
+        counts = np.zeros((len(self), len(self.classes)), dtype=np.float64)
+        matched = node >= 0
+        np.add.at(counts, (node[matched], y_index[matched]), 1)
+        self.leaf_counts = counts
+
+    def predict_proba(self, X):
+        """ Class frequencies (in the order of self.classes) of the leaf reached by each
+        row of X; a row with no matching branch, or reaching a leaf with no counted row,
+        gets zeros. count_leaves must be called first """
+        mirrored = None
+        if self.canonical:
+            X, mirrored = canonical_matrix(X)
+        node = self.leaf_indices(X)
+        counts = self.leaf_counts[np.maximum(node, 0)]
+        counts[node < 0] = 0
+        if mirrored is not None:
+            counts[mirrored] = counts[mirrored, ::-1]
+        totals = counts.sum(axis=1, keepdims=True)
+        return np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+
+def compile_tree(tree, features=None, canonical=False):
+    """ Compiles the dict tree. features gives the order of the columns of the
+    inputs (default: the 42 board cells); canonical: the tree was trained on canonical
+    boards (only with the 42 cells) """
+    features = CELL_FEATURES if features is None else list(features)
+    index = {name: i for i, name in enumerate(features)}
+    feature, t1, t2, children, leaf = [], [], [], [], []
+    labels = []
+    label_index = {}
+
+    def add(subtree):
+        node = len(feature)
+        feature.append(-1)
+        t1.append(0.0)
+        t2.append(0.0)
+        children.append([NO_CHILD, NO_CHILD, NO_CHILD])
+        leaf.append(-1)
+        if not isinstance(subtree, dict):
+            key = (type(subtree), subtree)
+            if key not in label_index:
+                label_index[key] = len(labels)
+                labels.append(subtree)
+            leaf[node] = label_index[key]
+            return node
+        name = next(iter(subtree))
+        feature[node] = index[name]
+        thresholds = {}
+        for key, child in subtree[name].items():
+            branch, values = _parse_branch(key)
+            thresholds[branch] = values
+            children[node][branch] = add(child)
+        if 1 in thresholds:
+            t1[node], t2[node] = thresholds[1]
+        else:
+            t1[node] = t2[node] = thresholds.get(0, thresholds.get(2))[0]
+        return node
+
+    add(tree)
+    return CompiledTree(features, feature, t1, t2, children, leaf, labels, canonical)
@@ -2,7 +2,10 @@ import random
 import os
 import time
 from mcts import MCTS
-from decision_tree_model import train_tree, predict_from_tree
+from bitboard import Position
+from clock import GameClock
+from model_store import load_compiled
+from opening_book import default_book, book_move
 
 
 class Game(object):
@@ -10,6 +13,7 @@ class Game(object):
     """
     
     board = None
+    position = None
     round = None
     finished = None
     winner = None
@@ -22,10 +26,12 @@ class Game(object):
         self.round = 1
         self.finished = False
         self.winner = None
+        # each game has its own players (the class attribute was shared by all the games)
+        self.players = [None, None]
         
-        # do cross-platform clear screen
-        os.system( [ 'clear', 'cls' ][ os.name == 'nt' ] )
         if not silent:
+            # do cross-platform clear screen
+            os.system( [ 'clear', 'cls' ][ os.name == 'nt' ] )
             print(u"Welcome to {0}!".format(self.game_name))
             self.configure_player(0)
             self.configure_player(1)
@@ -37,6 +43,8 @@ class Game(object):
             self.board.append([])
             for j in range(7):
                 self.board[i].append(' ')
+        # bitboard copy of the board, used for the move and win checks
+        self.position = Position()
 
 
     def configure_player(self, index):
@@ -63,14 +71,16 @@ class Game(object):
                     name = f"MCTS_{['Easy', 'Medium', 'Hard'][int(diff)-1]}"
                     iterations = [50, 250, 1000][int(diff)-1]
                     c_value = [2, 1, 1.41][int(diff)-1]
-                    self.players[index] = AIPlayer_MCTS(name, self.colors[index], iterations, c_value)
+                    solver_threshold = [0, 0, 12][int(diff)-1]
+                    self.players[index] = AIPlayer_MCTS(name, self.colors[index], iterations, c_value,
+                                                        use_book=int(diff) == 3, solver_threshold=solver_threshold)
 
                 elif ai_choice == '2':
                     print("Choose difficulty:\n1. Easy\n2. Medium\n3. Hard")
                     diff = input("Enter 1, 2 or 3: ").strip()
                     name = f"DT_{['Easy', 'Medium', 'Hard'][int(diff)-1]}"
                     difficulty = ['easy', 'medium', 'hard'][int(diff)-1]
-                    self.players[index] = AIPlayer_DT(name, self.colors[index], difficulty)
+                    self.players[index] = AIPlayer_DT(name, self.colors[index], difficulty, use_book=int(diff) == 3)
 
 
                 else:
@@ -90,6 +100,7 @@ class Game(object):
             self.board.append([])
             for j in range(7):
                 self.board[i].append(' ')
+        self.position = Position(self.players[0].color)
     
     def newGame(self):
         """ Function to reset the game, but not the names or colors """
@@ -101,6 +112,7 @@ class Game(object):
         self.turn = self.players[0]
 
         self.board = [[' ' for _ in range(7)] for _ in range(6)]
+        self.position = Position(self.turn.color)
 
 
     def switchTurn(self):
@@ -115,32 +127,32 @@ class Game(object):
     def nextMove(self,silent = False):
         player = self.turn
 
-        # there are only 42 legal places for pieces on the board
-        # exactly one piece is added to the board each turn
-        if self.round > 42:
-            self.finished = True
-            #this is a tie
-            return
-        
-        # store the board before the play
-        state_before_play = self.board 
-        
         # move is the column that player want's to play
         move = player.move(self.board, silent)
             
 
         #verify if the column has space
-        for i in range(6):
-            if self.board[i][move] == ' ':
-                self.board[i][move] = player.color
-                self.switchTurn()
-                self.checkForFours()
-                if not silent:
-                    self.printState()
-                    print("{0} played in column {1}.".format(player.name, (move+1)))
-                    
-                    
-                return
+        if self.position.can_play(move):
+            self.board[self.position.height(move)][move] = player.color
+            self.position.play(move)
+            self.switchTurn()
+            # only the lines through the new piece can make a new four in a row
+            if self.position.last_move_won():
+                self.setWinner(player.color)
+            # there are only 42 legal places for pieces on the board
+            # exactly one piece is added to the board each turn
+            elif self.position.moves == 42:
+                self.finished = True
+                #this is a tie
+            if self.finished:
+                # nothing left to think about during the opponent's turn
+                for p in self.players:
+                    if hasattr(p, 'stop_pondering'):
+                        p.stop_pondering()
+            if not silent:
+                self.printState()
+                print("{0} played in column {1}.".format(player.name, (move+1)))
+            return
 
         if not silent:
             # if we get here, then the column is full
@@ -148,30 +160,18 @@ class Game(object):
             return
     
     def checkForFours(self):
-        #a function that calls other functions to verify if the game ended
-        #if any returns true, the game ends
+        #verifies if the game ended, using the bitboard of the game (see bitboard.py)
         #this only checks, it doesnt return where the 4 in a row is, for that we have the "findFours"
-        # for each piece in the board
-        for i in range(6):
-            for j in range(7):
-                if self.board[i][j] != ' ':
-                    # check if a vertical four-in-a-row starts at (i, j)
-                    if self.verticalCheck(i, j):
-                        self.finished = True
-                        return
-                    
-                    # check if a horizontal four-in-a-row starts at (i, j)
-                    if self.horizontalCheck(i, j):
-                        self.finished = True
-                        return
-                    
-                    # check if a diagonal (either way) four-in-a-row starts at (i, j)
-                    # also, get the slope of the four if there is one
-                    diag_fours, slope = self.diagonalCheck(i, j)
-                    if diag_fours:
-                        print(slope)
-                        self.finished = True
-                        return
+        color = self.position.winner()
+        if color is not None:
+            self.setWinner(color)
+
+    def setWinner(self, color):
+        self.finished = True
+        if self.players[0].color == color:
+            self.winner = self.players[0]
+        else:
+            self.winner = self.players[1]
         
     def verticalCheck(self, row, col):
         
@@ -369,37 +369,83 @@ class AIPlayer_MCTS(Player):
         The AI algorithm is Monte Carlo Tree Search """
     
 
-    def __init__(self, name, color,iterations, c):
+    def __init__(self, name, color,iterations, c, reuse_tree=True, workers=1, worker_iterations=None,
+                 time_limit_ms=None, clock_ms=None, log_stats=False, use_book=False, solver_threshold=0,
+                 ponder=False, ponder_iterations=None):
         self.type = "AI"
         self.name = name
         self.color = color
         self.iterations = iterations
         self.c = c
+        # the same MCTS object is kept for the whole game, so the tree of the previous move
+        # (after our move and the opponent's reply) is reused; a new game starts a new tree.
+        # with workers > 1 the search is split over a process pool instead (see MCTS)
+        # time_limit_ms (per move) or clock_ms (whole game) replace the fixed iterations
+        # with solver_threshold empty cells or less the positions are solved exactly (solver.py);
+        # 0 (the default) never calls the solver, configure_player only enables it for Hard
+        # with ponder the tree keeps being searched in a thread during the opponent's turn
+        # (at most ponder_iterations, by default 20 * iterations, to bound the memory)
+        clock = GameClock(clock_ms) if clock_ms is not None else None
+        self.ponder = ponder
+        self.ponder_iterations = ponder_iterations if ponder_iterations is not None else 20 * iterations
+        self.mc = MCTS(None, iterations, c, keep_tree=reuse_tree or ponder, ponder=ponder,
+                       workers=workers, worker_iterations=worker_iterations,
+                       time_limit_ms=time_limit_ms, clock=clock, collect_stats=log_stats,
+                       solver_threshold=solver_threshold)
+        # with log_stats the SearchStats of every move are printed and kept here (see search_stats.py)
+        self.log_stats = log_stats
+        self.move_stats = []
+        # with use_book the first moves come from the opening book (opening_book.py), when
+        # there is one; configure_player only gives it to the Hard bots
+        self.book = default_book() if use_book else None
         
 
-    def move(self, state, silent):
+    def move(self, state, silent, deadline=None):
+            """ deadline: time.time() by which the move must be found (see MCTS.bestMove) """
             if not silent:
                 print("{0}'s turn.  {0} is {1}".format(self.name, self.color))
 
-            mc = MCTS(state, self.iterations, self.c)
-            best_move = mc.bestMove(state, self.color)
+            # the board list is converted to a bitboard once, the search only works on the bitboard
+            position = Position.from_board(state, self.color)
+            if self.mc.clock is not None and position.moves < 2:
+                # our first move of a new game
+                self.mc.clock.reset()
+            move = book_move(self.book, position)
+            if move is not None:
+                self.mc.stop_pondering()
+                return move
+            best_move = self.mc.bestMove(position, self.color, deadline)
+            if self.log_stats:
+                self.move_stats.append(self.mc.last_stats)
+                print(f"{self.name} [{position.moves + 1}] col {best_move + 1}: {self.mc.last_stats.summary()}")
+            if self.ponder:
+                self.mc.start_pondering(self.color, self.ponder_iterations)
             return best_move
 
+    def stop_pondering(self):
+        self.mc.stop_pondering()
+
     
     
 class AIPlayer_DT(Player):
-    def __init__(self, name, color, difficulty):
+    def __init__(self, name, color, difficulty, use_book=False):
         self.type = "AI"
         self.name = name
         self.color = color
         self.difficulty = difficulty
-        self.tree = train_tree(difficulty)
+        self.book = default_book() if use_book else None
+        # trained once per dataset/settings, then loaded from the model cache;
+        # the flat-array version of the tree is used for the predictions
+        self.tree, self.predictor = load_compiled(difficulty)
 
     def move(self, state, silent):
         if not silent:
             print(f"{self.name}'s turn. {self.name} is {self.color}")
         
-        move = int(predict_from_tree(self.tree, state))
+        move = book_move(self.book, Position.from_board(state, self.color)) if self.book is not None else None
+        if move is not None:
+            return move
+        move = int(self.predictor.predict_board(state))
 
         # Corrigir se a coluna estiver cheia
         valid_columns = [c for c in range(7) if state[5][c] == ' ']
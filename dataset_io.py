@@ -0,0 +1,184 @@
+""" Binary format for the training datasets.
+
+A dataset is stored as two .npy files next to the CSV:
+    <name>.boards.npy   int8 (N, 42): the cells in CSV order, 0 empty, 1 'x', 2 'o'
+    <name>.labels.npy   int8 (N,): the column played
+np.load with mmap_mode='r' maps them without reading or copying anything, so
+millions of positions load in no time and go straight to build_tree_arrays.
+
+The keys of the rows (row_key, rows_to_keys) and KeySet are used to find the
+duplicate rows (selfplay.py, incremental_tree.py).
+
+Convert the CSVs with:
+    python dataset_io.py mcts_dataset_easy.csv mcts_dataset_medium.csv ...
+"""
+import os
+import sys
+import numpy as np
+from compiled_tree import CELL_FEATURES
+from bitboard import ROWS, COLS, H1, BOTTOM_MASK, COLUMN_MASK, mirror_mask, mirror_move
+
+N_CELLS = len(CELL_FEATURES)
+
+# byte -> cell value (the same mapping as CELL_MAPPING, anything else is empty)
+_CELL_TABLE = np.zeros(256, dtype=np.int8)
+_CELL_TABLE[ord('x')] = 1
+_CELL_TABLE[ord('o')] = 2
+
+
+def binary_paths(path):
+    """ (boards path, labels path) of the dataset path (.csv or no extension) """
+    base = path[:-4] if path.endswith('.csv') else path
+    return base + '.boards.npy', base + '.labels.npy'
+
+
+def parse_csv(path):
+    """ Reads a dataset CSV (42 one-character cells and the label per line) without pandas.
+    Returns (boards int8 (N, 42), labels int8 (N,)) """
+    with open(path, 'rb') as f:
+        data = f.read().replace(b'\r', b'')
+    if data and not data.endswith(b'\n'):
+        data += b'\n'
+    # every line has the same layout "c,c,...,c,L\n": read them all as one byte matrix
+    width = 2 * N_CELLS + 2
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) % width == 0 and (raw[width - 1::width] == ord('\n')).all() \
+            and (raw.reshape(-1, width)[:, 1:2 * N_CELLS:2] == ord(',')).all():
+        rows = raw.reshape(-1, width)
+        boards = _CELL_TABLE[rows[:, 0:2 * N_CELLS:2]]
+        labels = (rows[:, 2 * N_CELLS] - ord('0')).astype(np.int8)
+        return boards, labels
+    # other layouts (spaces trimmed, labels with more digits...): line by line
+    lines = [line for line in data.split(b'\n') if line]
+    boards = np.zeros((len(lines), N_CELLS), dtype=np.int8)
+    labels = np.zeros(len(lines), dtype=np.int8)
+    for i, line in enumerate(lines):
+        fields = line.split(b',')
+        boards[i] = [_CELL_TABLE[cell.strip()[0]] if cell.strip() else 0
+                     for cell in fields[:N_CELLS]]
+        labels[i] = int(fields[N_CELLS])
+    return boards, labels
+
+
+def save_binary(path, boards, labels):
+    """ Writes the two .npy files of the dataset path """
+    boards_path, labels_path = binary_paths(path)
+    np.save(boards_path, np.ascontiguousarray(boards, dtype=np.int8))
+    np.save(labels_path, np.ascontiguousarray(labels, dtype=np.int8))
+    return boards_path, labels_path
+
+
+def load_binary(path, mmap=True):
+    """ (boards, labels) from the .npy files, memory-mapped (read only) by default """
+    boards_path, labels_path = binary_paths(path)
+    mode = 'r' if mmap else None
+    return np.load(boards_path, mmap_mode=mode), np.load(labels_path, mmap_mode=mode)
+
+
+def has_binary(path):
+    """ True if the .npy files exist and are not older than the CSV (when there is one) """
+    boards_path, labels_path = binary_paths(path)
+    if not (os.path.exists(boards_path) and os.path.exists(labels_path)):
+        return False
+    if not os.path.exists(path):
+        return True
+    csv_time = os.path.getmtime(path)
+    return min(os.path.getmtime(boards_path), os.path.getmtime(labels_path)) >= csv_time
+
+
+def dataset_files(path):
+    """ Files load_dataset(path) reads """
+    if has_binary(path):
+        return list(binary_paths(path))
+    return [path]
+
+
+def load_dataset(path):
+    """ (boards, labels) of a dataset: the binary files if they are up to date,
+    otherwise the CSV """
+    if has_binary(path):
+        return load_binary(path)
+    return parse_csv(path)
+
+
+def row_key(position, move):
+    """ Key of the dataset row (board of the position, move). The board part is
+    the key of the position as seen by 'x', which does not depend on who is to move;
+    of the row and its mirror image, the one with the smaller board is used """
+    board = position.masks[0] + (position.masks[0] | position.masks[1]) + BOTTOM_MASK
+    mirrored = mirror_mask(board)
+    if mirrored < board:
+        board, move = mirrored, mirror_move(move)
+    elif mirrored == board:
+        # symmetric board: a move and its mirror are the same move
+        move = min(move, mirror_move(move))
+    return board * 8 + move
+
+
+# bit of each of the 42 cells (CSV order: row by row from the bottom)
+_CELL_BITS = np.array([col * H1 + row for row in range(ROWS) for col in range(COLS)], dtype=np.uint64)
+
+
+def rows_to_keys(boards, moves):
+    """ row_key of every row of a (N, 42) matrix of cell values (0, 1 'x', 2 'o') """
+    boards = np.asarray(boards)
+    bits = np.uint64(1) << _CELL_BITS
+    x = np.where(boards == 1, bits, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+    occupied = np.where(boards != 0, bits, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+    board = x + occupied + np.uint64(BOTTOM_MASK)
+    moves = np.asarray(moves, dtype=np.uint64)
+    # canonical form, as in row_key
+    mirrored = np.zeros_like(board)
+    for col in range(COLS):
+        column = (board >> np.uint64(col * H1)) & np.uint64(COLUMN_MASK)
+        mirrored |= column << np.uint64((COLS - 1 - col) * H1)
+    mirror_moves = np.uint64(COLS - 1) - moves
+    moves = np.where(mirrored < board, mirror_moves,
+                     np.where(mirrored == board, np.minimum(moves, mirror_moves), moves))
+    return np.minimum(board, mirrored) * np.uint64(8) + moves
+
+
+class KeySet(object):
+    """ Exact set of uint64 keys: a sorted array plus a small buffer of new keys
+    that is merged into it from time to time """
+
+    def __init__(self, merge_every=1 << 16):
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.pending = set()
+        self.merge_every = merge_every
+
+    def __len__(self):
+        return len(self.keys) + len(self.pending)
+
+    def __contains__(self, key):
+        if key in self.pending:
+            return True
+        i = np.searchsorted(self.keys, np.uint64(key))
+        return i < len(self.keys) and int(self.keys[i]) == key
+
+    def add(self, key):
+        self.pending.add(key)
+        if len(self.pending) >= self.merge_every:
+            self.merge()
+
+    def update(self, keys):
+        self.keys = np.union1d(self.keys, np.asarray(keys, dtype=np.uint64))
+
+    def merge(self):
+        if self.pending:
+            self.update(np.fromiter(self.pending, dtype=np.uint64, count=len(self.pending)))
+            self.pending.clear()
+
+
+def convert(path):
+    boards, labels = parse_csv(path)
+    return save_binary(path, boards, labels), len(labels)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python dataset_io.py dataset.csv [dataset.csv ...]")
+        sys.exit(1)
+    for csv_path in sys.argv[1:]:
+        (boards_path, labels_path), n = convert(csv_path)
+        print(f"{csv_path}: {n} positions -> {boards_path}, {labels_path}")
@@ -1,6 +1,9 @@
-import pandas as pd
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from collections import Counter
+from compiled_tree import CompiledTree, CELL_FEATURES, MIRROR, COLS, compile_tree, canonical_dataset
+from dataset_io import load_dataset
 
 #Computing entropy
 def entropy(labels):
@@ -37,65 +40,181 @@ def information_gain(data, feature, threshold):
 """ Finding the best feature to split on
 
 - Avoids splitting on exact values (which can overfit).
-- Reduces the number of splits tested, making it faster. """
-def find_best_split(data, features):
+- Reduces the number of splits tested, making it faster.
+
+The split search does not slice the data for each candidate threshold: the features
+are encoded once as small integer codes (one per distinct value), and for each node
+a histogram counts[feature, value, class] is built in a single pass. Every one- or
+two-threshold split is a cut between two consecutive values present in the node, so
+the class counts of each part come from cumulative sums of that histogram and all
+the candidates of all the features are scored at once with NumPy. """
+
+def encode_features(X):
+    """ Encodes each column of X by the index of its value in the sorted distinct values.
+    Returns (codes (N, F) int array, list with the sorted distinct values of each feature) """
+    X = np.asarray(X)
+    codes = np.empty(X.shape, dtype=np.int32)
+    values = []
+    for f in range(X.shape[1]):
+        uniques, inverse = np.unique(X[:, f], return_inverse=True)
+        codes[:, f] = inverse
+        values.append(uniques)
+    return codes, values
+
+def class_histogram(codes, y_codes, rows, feats, n_values, n_classes):
+    """ counts[i, v, k]: rows of the node with value code v in feature feats[i] and class k """
+    sub = codes[np.ix_(rows, feats)] if len(rows) != len(codes) else codes[:, feats]
+    offsets = np.arange(len(feats), dtype=np.int64) * (n_values * n_classes)
+    index = offsets + sub.astype(np.int64) * n_classes + y_codes[rows, None]
+    counts = np.bincount(index.ravel(), minlength=len(feats) * n_values * n_classes)
+    return counts.reshape(len(feats), n_values, n_classes)
+
+def entropy_of_counts(counts):
+    """ Entropy of each class-count vector on the last axis, and the number of rows of each """
+    n = counts.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = counts / n[..., None]
+        terms = np.where(counts > 0, p * np.log2(np.where(counts > 0, p, 1)), 0.0)
+    return -terms.sum(axis=-1), n
+
+def _valid_cuts(counts):
+    """ cut a = between value a and the next present value; valid if value a is present
+    and some larger value is present too. Also returns the index of that next value """
+    present = counts.sum(axis=2) > 0
+    n_values = present.shape[1]
+    # index of the next present value after a (n_values if there is none)
+    next_present = np.full(present.shape, n_values)
+    following = np.full(present.shape[0], n_values)
+    for v in range(n_values - 1, -1, -1):
+        next_present[:, v] = following
+        following = np.where(present[:, v], v, following)
+    valid = present & (next_present < n_values)
+    return valid[:, :-1], next_present[:, :-1]
+
+def _threshold(values, a, next_value):
+    return (values[a] + values[next_value]) / 2
+
+# gains closer than this can be the same gain summed in a different order
+GAIN_TOLERANCE = 1e-12
+
+def _best_candidates(gain):
+    """ Flat indices (in loop order: feature, then threshold) of the splits with the largest gain.
+    There is more than one only on (near) ties """
+    best = gain.max()
+    if not best > 0:
+        return []
+    return np.flatnonzero(gain >= best - GAIN_TOLERANCE)
+
+def best_splits_from_histogram(counts, values):
+    """ Best single thresholds: list of (feature position, threshold), usually just one.
+    values[i] are the sorted distinct values of the feature of counts[i] """
+    if counts.shape[1] < 2:
+        return []
+    total_entropy, total = entropy_of_counts(counts[0].sum(axis=0))
+    valid, next_present = _valid_cuts(counts)
+    cum = counts.cumsum(axis=1)[:, :-1]
+    h_left, n_left = entropy_of_counts(cum)
+    h_right, n_right = entropy_of_counts(counts.sum(axis=1)[:, None, :] - cum)
+    gain = total_entropy - (n_left / total * h_left + n_right / total * h_right)
+    gain = np.where(valid, gain, -np.inf)
+    splits = []
+    for best in _best_candidates(gain):
+        f, a = divmod(int(best), gain.shape[1])
+        splits.append((f, _threshold(values[f], a, next_present[f, a])))
+    return splits
+
+def best_two_splits_from_histogram(counts, values):
+    """ Best pairs of thresholds: list of (feature position, t1, t2), usually just one """
+    return [split for _, split in scored_two_splits(counts, values)]
+
+def scored_two_splits(counts, values):
+    """ Like best_two_splits_from_histogram, with the gain of each split: [(gain, split)].
+    The gain of a feature does not depend on the others, so the candidates of
+    groups of features can be merged with merge_scored_splits """
+    n_cuts = counts.shape[1] - 1
+    if n_cuts < 2:
+        return []
+    total_entropy, total = entropy_of_counts(counts[0].sum(axis=0))
+    valid, next_present = _valid_cuts(counts)
+    first, second = np.triu_indices(n_cuts, k=1)  # every pair a < b, in the same order as the loops
+    cum = counts.cumsum(axis=1)
+    left = cum[:, first]
+    middle = cum[:, second] - left
+    right = cum[:, -1][:, None, :] - cum[:, second]
+    h_left, n_left = entropy_of_counts(left)
+    h_middle, n_middle = entropy_of_counts(middle)
+    h_right, n_right = entropy_of_counts(right)
+    weighted = (n_left * h_left + n_middle * h_middle + n_right * h_right) / total
+    gain = np.where(valid[:, first] & valid[:, second], total_entropy - weighted, -np.inf)
+    splits = []
+    for best in _best_candidates(gain):
+        f, p = divmod(int(best), gain.shape[1])
+        a, b = first[p], second[p]
+        splits.append((float(gain[f, p]), (f, _threshold(values[f], a, next_present[f, a]),
+                                            _threshold(values[f], b, next_present[f, b]))))
+    return splits
+
+def merge_scored_splits(groups):
+    """ groups: scored_two_splits of consecutive groups of features (feature positions
+    relative to the whole list). Returns the same splits as scoring all of them at once """
+    scored = [item for group in groups for item in group]
+    if not scored:
+        return []
+    best = max(gain for gain, _ in scored)
+    return [split for gain, split in scored if gain >= best - GAIN_TOLERANCE]
+
+def _break_tie(splits, labels, columns):
+    """ On a tie, recomputes the gains of the tied splits exactly like the original loops
+    (Counter entropies, same order of operations), so the chosen split is the same.
+    columns[i] are the values of the feature of splits[i] """
+    if len(splits) == 1:
+        return splits[0]
+    total_entropy = entropy(labels)
+    n = len(labels)
     best_gain = 0
-    best_feature = None
-    best_threshold = None
-    
-    for feature in features:
-        sorted_values = sorted(data[feature].unique())
-        thresholds = [(sorted_values[i] + sorted_values[i+1]) / 2 for i in range(len(sorted_values) - 1)]
-        
-        for threshold in thresholds:
-            gain = information_gain(data, feature, threshold)
-            if gain > best_gain:
-                best_gain = gain
-                best_feature = feature
-                best_threshold = threshold
-    
-    return best_feature, best_threshold
+    best = splits[0]
+    for split, column in zip(splits, columns):
+        if len(split) == 3:
+            _, t1, t2 = split
+            left = labels[column <= t1]
+            middle = labels[(column > t1) & (column <= t2)]
+            right = labels[column > t2]
+            gain = total_entropy - (len(left) / n * entropy(left) + len(middle) / n * entropy(middle)
+                                    + len(right) / n * entropy(right))
+        else:
+            _, t = split
+            left = labels[column <= t]
+            right = labels[column > t]
+            gain = total_entropy - (len(left) / n * entropy(left) + len(right) / n * entropy(right))
+        if gain > best_gain:
+            best_gain = gain
+            best = split
+    return best
+
+def _prepare(data, features):
+    X = data[features].to_numpy()
+    codes, values = encode_features(X)
+    classes, y_codes = np.unique(data['label'].to_numpy(), return_inverse=True)
+    n_values = max(len(v) for v in values) if values else 0
+    counts = class_histogram(codes, y_codes, np.arange(len(codes)), list(range(len(features))),
+                             n_values, len(classes))
+    return X, values, counts
+
+def find_best_split(data, features):
+    X, values, counts = _prepare(data, features)
+    splits = best_splits_from_histogram(counts, values)
+    if not splits:
+        return None, None
+    f, threshold = _break_tie(splits, data['label'].to_numpy(), [X[:, split[0]] for split in splits])
+    return features[f], threshold
 
 def find_best_two_splits(data, features):
-    best_gain = 0
-    best_feature = None
-    best_thresholds = (None, None)
-    
-    for feature in features:
-        sorted_values = sorted(data[feature].unique())
-        thresholds = [(sorted_values[i] + sorted_values[i+1]) / 2 for i in range(len(sorted_values) - 1)]
-        
-        # Try all pairs of thresholds
-        for i in range(len(thresholds)):
-            for j in range(i + 1, len(thresholds)):
-                t1 = thresholds[i]
-                t2 = thresholds[j]
-                
-                # Split into 3 parts: <= t1, (t1, t2], > t2
-                left = data[data[feature] <= t1]
-                middle = data[(data[feature] > t1) & (data[feature] <= t2)]
-                right = data[data[feature] > t2]
-                
-                # Calculate weighted entropy
-                total_entropy = entropy(data['label'].values)
-                weight_left = len(left) / len(data)
-                weight_middle = len(middle) / len(data)
-                weight_right = len(right) / len(data)
-                
-                weighted_entropy = (
-                    weight_left * entropy(left['label'].values) +
-                    weight_middle * entropy(middle['label'].values) +
-                    weight_right * entropy(right['label'].values)
-                )
-                
-                gain = total_entropy - weighted_entropy
-                
-                if gain > best_gain:
-                    best_gain = gain
-                    best_feature = feature
-                    best_thresholds = (t1, t2)
-    
-    return best_feature, best_thresholds
+    X, values, counts = _prepare(data, features)
+    splits = best_two_splits_from_histogram(counts, values)
+    if not splits:
+        return None, (None, None)
+    f, t1, t2 = _break_tie(splits, data['label'].to_numpy(), [X[:, split[0]] for split in splits])
+    return features[f], (t1, t2)
 
 """ Building of the decision tree recursively
 
@@ -107,44 +226,208 @@ Preventing Overfitting in build_tree
 
 MAX_DEPTH = 10  # Example limit
 MIN_SAMPLES = 5  # Minimum number of samples in a node
+# train on canonical boards: a board and its mirror image are one row (compiled_tree.canonical_dataset)
+CANONICAL = True
+
+def _majority(classes, y_codes, rows, n_classes):
+    """ Most common label of the rows; on a tie the one that appears first, like Counter.most_common """
+    counts = np.bincount(y_codes[rows], minlength=n_classes)
+    tied = np.flatnonzero(counts == counts.max())
+    if len(tied) > 1:
+        first_seen = [np.argmax(y_codes[rows] == k) for k in tied]
+        label = classes[tied[int(np.argmin(first_seen))]]
+    else:
+        label = classes[tied[0]]
+    return label.item() if hasattr(label, 'item') else label
+
+def build_tree_two_thresholds(data, features, depth=0, max_depth=None, min_samples=None, workers=1):
+    """ data: DataFrame with the features and a 'label' column """
+    return build_tree_arrays(data[features].to_numpy(), data['label'].to_numpy(), features,
+                             depth, max_depth, min_samples, workers)
+
+def build_tree_arrays(X, y, features, depth=0, max_depth=None, min_samples=None, workers=1):
+    """
+    Same tree as build_tree_two_thresholds, from a (N, F) feature matrix and the labels.
+    features are the names of the columns of X (used as the keys of the tree).
+    max_depth and min_samples default to MAX_DEPTH and MIN_SAMPLES.
+    workers > 1 builds it with a process pool (None: one worker per core), same tree.
+    """
+    max_depth = MAX_DEPTH if max_depth is None else max_depth
+    min_samples = MIN_SAMPLES if min_samples is None else min_samples
+    codes, values = encode_features(X)
+    classes, y_codes = np.unique(np.asarray(y), return_inverse=True)
+    args = (codes, values, classes, y_codes, list(features), max_depth, min_samples)
+    rows = np.arange(len(codes))
+    feats = list(range(len(features)))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(codes) <= SERIAL_ROWS:
+        return TreeBuilder(*args).build(rows, feats, depth)
+    # about 4 subtrees per worker, to balance the load
+    subtree_rows = max(SERIAL_ROWS, len(codes) // (4 * workers))
+    with ProcessPoolExecutor(workers, initializer=_init_builder, initargs=args) as pool:
+        builder = _ParallelTreeBuilder(pool, workers, subtree_rows, *args)
+        return builder.resolve(builder.build_parallel(rows, feats, depth))
+
+class TreeBuilder(object):
+    """ Holds the encoded data while the tree is built (the nodes only pass row indices) """
+
+    def __init__(self, codes, values, classes, y_codes, names, max_depth, min_samples):
+        self.codes = codes
+        self.values = values
+        self.classes = classes
+        self.y_codes = y_codes
+        self.names = names
+        self.max_depth = max_depth
+        self.min_samples = min_samples
+        self.n_classes = len(classes)
+        self.n_values = max(len(v) for v in values) if values else 0
+
+    def score_features(self, rows, feats):
+        """ Candidate splits of the rows on feats: [(gain, (feature position, t1, t2))] """
+        counts = class_histogram(self.codes, self.y_codes, rows, feats, self.n_values, self.n_classes)
+        return scored_two_splits(counts, [self.values[f] for f in feats])
+
+    def find_split(self, rows, feats):
+        """ Best (feature, t1, t2) for the rows, or None """
+        splits = merge_scored_splits([self.score_features(rows, feats)])
+        if not splits:
+            return None
+        splits = [(feats[i], t1, t2) for i, t1, t2 in splits]
+        if len(splits) > 1:
+            columns = [self.values[f][self.codes[rows, f]] for f, _, _ in splits]
+            return _break_tie(splits, self.y_codes[rows], columns)
+        return splits[0]
+
+    def leaf(self, rows):
+        return _majority(self.classes, self.y_codes, rows, self.n_classes)
+
+    def split_node(self, rows, feats, depth):
+        """ None if the node is a leaf, else (feature, t1, t2, rows of the 3 parts) """
+        y_rows = self.y_codes[rows]
+
+        # Stopping conditions
+        if (len(rows) < self.min_samples or len(feats) == 0 or depth >= self.max_depth
+                or (y_rows == y_rows[0]).all()):
+            return None
+
+        split = self.find_split(rows, feats)
+
+        # If no good split is found, return majority label
+        if split is None:
+            return None
+        f, t1, t2 = split
+
+        # Split into 3 parts
+        column = self.values[f][self.codes[rows, f]]
+        left_rows = rows[column <= t1]
+        middle_rows = rows[(column > t1) & (column <= t2)]
+        right_rows = rows[column > t2]
+
+        # (Optional: Stop if one of the splits is empty)
+        if len(left_rows) == 0 or len(middle_rows) == 0 or len(right_rows) == 0:
+            return None
+        return f, t1, t2, (left_rows, middle_rows, right_rows)
+
+    def node(self, f, t1, t2, subtrees):
+        name = self.names[f]
+        left, middle, right = subtrees
+        tree = {name: {}}
+        tree[name]['<= ' + str(t1)] = left
+        tree[name]['(' + str(t1) + ', ' + str(t2) + ']'] = middle
+        tree[name]['> ' + str(t2)] = right
+        return tree
 
-def build_tree_two_thresholds(data, features, depth=0):
-    labels = data['label']
-
-    # Stopping conditions
-    if len(set(labels)) == 1 or len(features) == 0 or len(data) < MIN_SAMPLES or depth >= MAX_DEPTH:
-        return Counter(labels).most_common(1)[0][0]
-
-    # Use the two-threshold function here
-    best_feature, (t1, t2) = find_best_two_splits(data, features)
-    
-    # If no good split is found, return majority label
-    if best_feature is None or t1 is None or t2 is None:
-        return Counter(labels).most_common(1)[0][0]
-
-    # Split into 3 parts
-    left_data = data[data[best_feature] <= t1]
-    middle_data = data[(data[best_feature] > t1) & (data[best_feature] <= t2)]
-    right_data = data[data[best_feature] > t2]
-
-    # (Optional: Stop if one of the splits is empty)
-    if len(left_data) == 0 or len(middle_data) == 0 or len(right_data) == 0:
-        return Counter(labels).most_common(1)[0][0]
-
-    # Continue building the tree
-    new_features = [f for f in features if f != best_feature]
-
-    tree = {best_feature: {}}
-    tree[best_feature]['<= ' + str(t1)] = build_tree_two_thresholds(left_data, new_features, depth + 1)
-    tree[best_feature]['(' + str(t1) + ', ' + str(t2) + ']'] = build_tree_two_thresholds(middle_data, new_features, depth + 1)
-    tree[best_feature]['> ' + str(t2)] = build_tree_two_thresholds(right_data, new_features, depth + 1)
-
-    return tree
+    def build(self, rows, feats, depth):
+        split = self.split_node(rows, feats, depth)
+        if split is None:
+            return self.leaf(rows)
+        f, t1, t2, parts = split
+
+        # Continue building the tree
+        new_feats = [g for g in feats if g != f]
+        return self.node(f, t1, t2, [self.build(part, new_feats, depth + 1) for part in parts])
+
+
+""" Parallel building
+
+The subtrees of a node are independent, so the nodes near the root are split in this
+process and the subtrees below them are built by a process pool, each one by the
+serial builder. At very large nodes the scoring of the features is also split
+between the workers (groups of features, merged with merge_scored_splits). Small
+subtrees are built here, they are not worth the cost of sending them.
+The workers get the encoded data once, when they start, and the jobs only carry row
+indices, so the tree is exactly the one of the serial builder. """
+
+SERIAL_ROWS = 2000      # subtrees up to this size are built in this process
+SPLIT_ROWS = 200000     # nodes from this size have their features scored in the pool
+
+# builder of the worker process, set by _init_builder
+_worker_builder = None
+
+def _init_builder(*args):
+    global _worker_builder
+    _worker_builder = TreeBuilder(*args)
+
+def _build_subtree(rows, feats, depth):
+    return _worker_builder.build(rows, feats, depth)
+
+def _score_features(rows, feats, offset):
+    scored = _worker_builder.score_features(rows, feats)
+    return [(gain, (i + offset, t1, t2)) for gain, (i, t1, t2) in scored]
+
+class _ParallelTreeBuilder(TreeBuilder):
+
+    def __init__(self, pool, workers, subtree_rows, *args):
+        super().__init__(*args)
+        self.pool = pool
+        self.workers = workers
+        self.subtree_rows = subtree_rows
+
+    def score_features(self, rows, feats):
+        if len(rows) < SPLIT_ROWS or len(feats) < 2:
+            return super().score_features(rows, feats)
+        groups = [g for g in np.array_split(np.arange(len(feats)), self.workers) if len(g)]
+        futures = [self.pool.submit(_score_features, rows, [feats[i] for i in g], int(g[0]))
+                   for g in groups]
+        return [item for f in futures for item in f.result()]
+
+    def build_parallel(self, rows, feats, depth):
+        """ Like build, but the subtrees are futures until resolve() """
+        if len(rows) <= SERIAL_ROWS:
+            return self.build(rows, feats, depth)
+        if len(rows) <= self.subtree_rows:
+            return self.pool.submit(_build_subtree, rows, feats, depth)
+        split = self.split_node(rows, feats, depth)
+        if split is None:
+            return self.leaf(rows)
+        f, t1, t2, parts = split
+        new_feats = [g for g in feats if g != f]
+        return self.node(f, t1, t2, [self.build_parallel(part, new_feats, depth + 1) for part in parts])
+
+    def resolve(self, tree):
+        if hasattr(tree, 'result'):
+            return tree.result()
+        if isinstance(tree, dict):
+            branches = next(iter(tree.values()))
+            for key in branches:
+                branches[key] = self.resolve(branches[key])
+        return tree
 
 
 
 #Classification of new examples
-def classify(tree, row):
+def classify(tree, row, canonical=False):
+    """ canonical: the tree was trained on canonical boards (train_tree with CANONICAL), so
+    the row (with the 42 cell features) is classified in canonical form and the column
+    mirrored back. Other trees (any features) are used as they are """
+    if canonical:
+        x = [row[name] for name in CELL_FEATURES]
+        mirrored_x = [x[i] for i in MIRROR]
+        if mirrored_x < x:
+            label = classify(tree, dict(zip(CELL_FEATURES, mirrored_x)), False)
+            return None if label is None else COLS - 1 - label
+        return classify(tree, row, False)
     if not isinstance(tree, dict):
         return tree
     feature = next(iter(tree))
@@ -155,7 +438,7 @@ def classify(tree, row):
             # Example: '<= 1.75'
             threshold = float(key.split('<= ')[1])
             if row[feature] <= threshold:
-                return classify(sub_tree[key], row)
+                return classify(sub_tree[key], row, False)
         elif key.startswith('('):
             # Example: '(1.75, 3.0]'
             # First remove parentheses and brackets
@@ -164,52 +447,57 @@ def classify(tree, row):
             t1 = float(t1)
             t2 = float(t2)
             if t1 < row[feature] <= t2:
-                return classify(sub_tree[key], row)
+                return classify(sub_tree[key], row, False)
         elif key.startswith('>'):
             # Example: '> 3.0'
             threshold = float(key.split('> ')[1].strip(']'))  # Strip extra bracket if any
             if row[feature] > threshold:
-                return classify(sub_tree[key], row)
+                return classify(sub_tree[key], row, False)
     
     # fallback in case no condition matched
     return None
 
 
-def evaluate(tree, test_data):
-    correct = 0
-    for _, row in test_data.iterrows():
-        if classify(tree, row) == row['label']:
-            correct += 1
+def evaluate(tree, test_data, canonical=False):
+    """ tree: dict tree or CompiledTree; all the rows are classified in one batch.
+    canonical: a dict tree was trained on canonical boards (train_tree with CANONICAL) """
+    if not isinstance(tree, CompiledTree):
+        # a canonical tree reads the 42 cells in board order
+        tree = compile_tree(tree, None if canonical else [c for c in test_data.columns if c != 'label'],
+                            canonical=canonical)
+    predictions = tree.predict(test_data[tree.features].to_numpy())
+    correct = (predictions == test_data['label'].to_numpy()).sum()
     return correct / len(test_data)
 
-def train_tree(difficulty):
-    dataset_map = {
-        "easy": "mcts_dataset_easy.csv",
-        "medium": "mcts_dataset_medium.csv",
-        "hard": "mcts_dataset_hard.csv"
-    }
-
-    col_names = [f"cell_{i}" for i in range(42)] + ["label"]
-
-    
-
-    df = pd.read_csv(dataset_map[difficulty], header=None, names=col_names)
-
-    mapping = {" ": 0, "x": 1, "o": 2}
-    for i in range(42):
-        col = f"cell_{i}"
-        df[col] = df[col].apply(lambda x: mapping.get(x, 0))
-
+DATASETS = {
+    "easy": "mcts_dataset_easy.csv",
+    "medium": "mcts_dataset_medium.csv",
+    "hard": "mcts_dataset_hard.csv"
+}
 
+def train_tree(difficulty, workers=1):
+    # int8 boards (0 empty, 1 'x', 2 'o') from the .npy files if they were
+    # converted with dataset_io, else parsed from the CSV
+    boards, labels = load_dataset(DATASETS[difficulty])
+    if CANONICAL:
+        # the tree only sees one orientation of each board; compile it with canonical=CANONICAL
+        boards, labels = canonical_dataset(boards, labels)
 
     features = [f"cell_{i}" for i in range(42)]
-    tree = build_tree_two_thresholds(df, features)
+    tree = build_tree_arrays(boards, labels, features, workers=workers)
 
     return tree
 
+# the last dict tree given to predict_from_tree and its compiled version
+_last_compiled = (None, None)
+
 def predict_from_tree(tree, board):
-    mapping = {" ": 0, "x": 1, "o": 2}
-    flat_board = [mapping.get(cell.strip(), 0) for row in board for cell in row]
-    example = {f"cell_{i}": flat_board[i] for i in range(42)}
-    return classify(tree, example)
+    """ tree: dict tree or CompiledTree. A dict tree is compiled on the first call
+    (and kept while the same tree is used); it must come from train_tree """
+    global _last_compiled
+    if not isinstance(tree, CompiledTree):
+        if _last_compiled[0] is not tree:
+            _last_compiled = (tree, compile_tree(tree, canonical=CANONICAL))
+        tree = _last_compiled[1]
+    return tree.predict_board(board)
 
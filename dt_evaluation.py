@@ -0,0 +1,165 @@
+""" Evaluation of the decision trees: batch scoring, k-fold cross-validation and
+MAX_DEPTH/MIN_SAMPLES grid sweeps.
+
+Every (settings, fold) pair is an independent job (train on k-1 folds, score the
+other one), so they are spread over a process pool. The workers load the dataset
+once, when they start, and the jobs only carry row indices.
+
+    python dt_evaluation.py hard --depths 6 8 10 --min-samples 2 5 10 --folds 5
+"""
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from compiled_tree import CELL_FEATURES, compile_tree, canonical_dataset
+from dataset_io import load_dataset
+import decision_tree_model
+
+N_COLUMNS = 7
+
+# dataset of the worker process, set by _init_worker
+_data = None
+
+
+def dataset_path(dataset):
+    """ Difficulty name ('easy', ...) or path of a dataset -> path """
+    return decision_tree_model.DATASETS.get(dataset, dataset)
+
+
+def confusion_matrix(y_true, y_pred, n_labels=N_COLUMNS):
+    """ matrix[i, j]: rows with label i predicted as j """
+    matrix = np.zeros((n_labels, n_labels), dtype=np.int64)
+    np.add.at(matrix, (np.asarray(y_true, dtype=np.int64), np.asarray(y_pred, dtype=np.int64)), 1)
+    return matrix
+
+
+def score(tree, X, y, canonical=False):
+    """ Scores a tree (dict or CompiledTree) on the whole matrix X in one batch.
+    canonical: a dict tree was trained on canonical boards (train_tree with CANONICAL).
+    Rows that reach no leaf count as wrong and are left out of the confusion matrix """
+    if isinstance(tree, dict):
+        tree = compile_tree(tree, canonical=canonical)
+    y = np.asarray(y)
+    predicted = tree.predict(X)
+    matched = np.array([p is not None for p in predicted]) if predicted.dtype == object \
+        else np.ones(len(y), dtype=bool)
+    y_pred = predicted[matched].astype(np.int64)
+    y_true = y[matched]
+    return {"accuracy": float((y_pred == y_true).sum() / len(y)) if len(y) else 0.0,
+            "confusion": confusion_matrix(y_true, y_pred),
+            "unmatched": int(len(y) - matched.sum())}
+
+
+def kfold_indices(n, k, seed=0):
+    """ k (train rows, test rows) pairs; the rows are shuffled with seed first """
+    order = np.random.default_rng(seed).permutation(n)
+    folds = np.array_split(order, k)
+    return [(np.sort(np.concatenate(folds[:i] + folds[i + 1:])), np.sort(folds[i]))
+            for i in range(k)]
+
+
+def _init_worker(path):
+    global _data
+    _data = load_dataset(path)
+
+
+def _run_fold(max_depth, min_samples, canonical, train_rows, test_rows):
+    """ Trains on train_rows and scores on test_rows of the worker's dataset
+    (on canonical boards, like train_tree, if canonical) """
+    X, y = _data
+    start = time.perf_counter()
+    X_train, y_train = X[train_rows], y[train_rows]
+    if canonical:
+        X_train, y_train = canonical_dataset(X_train, y_train)
+    tree = decision_tree_model.build_tree_arrays(X_train, y_train, CELL_FEATURES,
+                                                 max_depth=max_depth, min_samples=min_samples)
+    train_time = time.perf_counter() - start
+    compiled = compile_tree(tree, canonical=canonical)
+    result = score(compiled, X[test_rows], y[test_rows])
+    result["train_time"] = train_time
+    result["time"] = time.perf_counter() - start
+    result["nodes"] = len(compiled)
+    return result
+
+
+def _summary(max_depth, min_samples, folds):
+    accuracies = np.array([f["accuracy"] for f in folds])
+    return {"max_depth": max_depth, "min_samples": min_samples,
+            "accuracy": float(accuracies.mean()), "accuracy_std": float(accuracies.std()),
+            "fold_accuracies": accuracies.tolist(),
+            "confusion": sum(f["confusion"] for f in folds),
+            "unmatched": sum(f["unmatched"] for f in folds),
+            "nodes": float(np.mean([f["nodes"] for f in folds])),
+            # total work of the configuration, over all its folds
+            "time": sum(f["time"] for f in folds)}
+
+
+def grid_search(dataset, max_depths=None, min_samples_list=None, k=5, workers=None, seed=0,
+                canonical=None):
+    """ k-fold cross-validation of every (max_depth, min_samples) pair.
+    Returns one summary per pair, best accuracy first. workers=1 runs in this process.
+    canonical defaults to decision_tree_model.CANONICAL; it is passed to the jobs, since the
+    workers do not see changes to the module globals of this process """
+    global _data
+    path = dataset_path(dataset)
+    canonical = decision_tree_model.CANONICAL if canonical is None else canonical
+    max_depths = [decision_tree_model.MAX_DEPTH] if max_depths is None else max_depths
+    min_samples_list = [decision_tree_model.MIN_SAMPLES] if min_samples_list is None else min_samples_list
+    n = len(load_dataset(path)[1])
+    folds = kfold_indices(n, k, seed)
+    jobs = [(d, m, canonical, train, test) for d in max_depths for m in min_samples_list
+            for train, test in folds]
+
+    if workers == 1:
+        _init_worker(path)
+        results = [_run_fold(*job) for job in jobs]
+        _data = None
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(path,)) as pool:
+            futures = [pool.submit(_run_fold, *job) for job in jobs]
+            results = [f.result() for f in futures]
+
+    summaries = []
+    for i in range(0, len(jobs), k):
+        summaries.append(_summary(jobs[i][0], jobs[i][1], results[i:i + k]))
+    summaries.sort(key=lambda s: -s["accuracy"])
+    return summaries
+
+
+def cross_validate(dataset, k=5, max_depth=None, min_samples=None, workers=None, seed=0,
+                   canonical=None):
+    """ k-fold cross-validation with one setting (by default MAX_DEPTH and MIN_SAMPLES) """
+    return grid_search(dataset, None if max_depth is None else [max_depth],
+                       None if min_samples is None else [min_samples], k, workers, seed, canonical)[0]
+
+
+def print_report(summaries, confusion=True):
+    print(f"{'depth':>5} {'min':>4} {'accuracy':>9} {'std':>6} {'nodes':>7} {'time (s)':>9}")
+    for s in summaries:
+        print(f"{s['max_depth']:>5} {s['min_samples']:>4} {s['accuracy']:>9.4f} "
+              f"{s['accuracy_std']:>6.4f} {s['nodes']:>7.0f} {s['time']:>9.2f}")
+    if confusion and summaries:
+        best = summaries[0]
+        print(f"\nConfusion of the best (depth {best['max_depth']}, min {best['min_samples']}),"
+              f" rows = played column, columns = predicted:")
+        for col, row in enumerate(best["confusion"]):
+            print(f"{col}: " + " ".join(f"{v:>5}" for v in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validation of the decision trees")
+    parser.add_argument("dataset", help="easy, medium, hard or the path of a dataset")
+    parser.add_argument("--depths", type=int, nargs="+")
+    parser.add_argument("--min-samples", type=int, nargs="+")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-canonical", action="store_true",
+                        help="train on the boards as they are, not on their canonical form")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summaries = grid_search(args.dataset, args.depths, args.min_samples, args.folds,
+                            args.workers, args.seed, canonical=not args.no_canonical)
+    print_report(summaries)
+    print(f"\nwall time: {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,271 @@
+""" Incremental training of the decision tree: new labelled positions update the tree
+that was trained before instead of training it again on the whole dataset.
+
+The tree is kept with, for each node, the rows that reach it and, for each internal
+node, the class histogram of its rows (the counts the splits are chosen from, see
+class_histogram). A batch of new rows only goes down the paths it follows:
+
+- an internal node adds the new rows to its histogram and scores the splits again;
+  if its split is still the best one the rows go on to its children, else the
+  subtree is built again from its rows;
+- a leaf is built again from its rows (it may now be split, or change its label).
+
+So an update costs about the size of the new rows times the depth, plus the size of
+the subtrees that are built again. With drift=0 the tree is always the one that
+build_tree_arrays gives on all the rows; with drift > 0 a split is kept while its gain
+is at most that fraction below the best one, so a few new rows do not rebuild a large
+subtree for a tiny improvement. A full rebuild is the same thing at the root (or when
+the new rows have a cell value or a label never seen before, which changes the
+encoding of the features).
+
+With decision_tree_model.CANONICAL the rows are put in canonical form and the
+duplicates are dropped, like in train_tree.
+
+    python incremental_tree.py hard shard-00000.csv shard-00001.csv --check
+"""
+import time
+import argparse
+import numpy as np
+import decision_tree_model
+from decision_tree_model import (TreeBuilder, encode_features, class_histogram, scored_two_splits,
+                                 merge_scored_splits, entropy_of_counts)
+from compiled_tree import CELL_FEATURES, compile_tree, canonical_matrix, canonical_labels
+from dataset_io import load_dataset, KeySet, rows_to_keys
+
+
+class _Node(object):
+    __slots__ = ('chunks', 'feats', 'depth', 'split', 'children', 'counts', 'label')
+
+    def __init__(self, rows, feats, depth):
+        # the rows are kept in chunks, so adding new rows does not copy the old ones
+        self.chunks = [rows]
+        self.feats = feats
+        self.depth = depth
+        self.split = None       # (feature, t1, t2) of an internal node
+        self.children = None
+        self.counts = None      # class histogram of the rows on feats (internal nodes)
+        self.label = None       # leaves
+
+    def rows(self):
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        return self.chunks[0]
+
+
+def split_gain(counts, values, t1, t2):
+    """ Information gain of the split (t1, t2) of one feature, from its histogram
+    counts (n_values, n_classes) """
+    counts = counts[:len(values)]   # the other value codes are padding
+    low = values <= t1
+    high = values > t2
+    parts = np.stack([counts[low].sum(axis=0), counts[~low & ~high].sum(axis=0), counts[high].sum(axis=0)])
+    h, n = entropy_of_counts(parts)
+    total_entropy, total = entropy_of_counts(counts.sum(axis=0))
+    return float(total_entropy - (n * h).sum() / total)
+
+
+class _CountingBuilder(TreeBuilder):
+    """ Keeps the histogram of the last node scored, so grow does not compute it twice """
+
+    def score_features(self, rows, feats):
+        self.last_counts = class_histogram(self.codes, self.y_codes, rows, feats,
+                                           self.n_values, self.n_classes)
+        return scored_two_splits(self.last_counts, [self.values[f] for f in feats])
+
+
+class IncrementalTree(object):
+    """ Decision tree on the 42 board cells that can be updated with new rows """
+
+    def __init__(self, X, y, max_depth=None, min_samples=None, drift=0.0, canonical=None):
+        self.max_depth = decision_tree_model.MAX_DEPTH if max_depth is None else max_depth
+        self.min_samples = decision_tree_model.MIN_SAMPLES if min_samples is None else min_samples
+        self.drift = drift
+        self.canonical = decision_tree_model.CANONICAL if canonical is None else canonical
+        self.seen = KeySet() if self.canonical else None
+        self.last_update = None
+        self.n = 0
+        X, y = self.prepare(X, y)
+        self.rebuild(X, y)
+
+    @classmethod
+    def from_dataset(cls, difficulty, **options):
+        boards, labels = load_dataset(decision_tree_model.DATASETS.get(difficulty, difficulty))
+        return cls(boards, labels, **options)
+
+    def prepare(self, X, y):
+        """ Canonical form of the new rows, without the ones already in the tree """
+        X = np.asarray(X)
+        y = np.asarray(y)
+        if not self.canonical:
+            return X, y
+        X, mirrored = canonical_matrix(X)
+        y = canonical_labels(X, y, mirrored)
+        keep = []
+        for i, key in enumerate(rows_to_keys(X, y).tolist()):
+            if key not in self.seen:
+                self.seen.add(key)
+                keep.append(i)
+        return X[keep], y[keep]
+
+    def rebuild(self, X, y):
+        """ Full training on (X, y), which become all the rows of the tree """
+        self.X = np.array(X, dtype=np.int8)
+        self.y = np.array(y)
+        self.n = len(self.y)
+        self.codes, self.values = encode_features(self.X)
+        self.classes, y_codes = np.unique(self.y, return_inverse=True)
+        self.y_codes = y_codes.astype(np.int64)
+        self.root = self.grow(np.arange(self.n), list(range(len(CELL_FEATURES))), 0)
+
+    def builder(self):
+        return _CountingBuilder(self.codes[:self.n], self.values, self.classes, self.y_codes[:self.n],
+                                CELL_FEATURES, self.max_depth, self.min_samples)
+
+    def grow(self, rows, feats, depth, builder=None):
+        """ Builds the subtree of rows, like TreeBuilder.build, keeping the rows and histograms """
+        builder = builder or self.builder()
+        node = _Node(rows, feats, depth)
+        split = builder.split_node(rows, feats, depth)
+        if split is None:
+            node.label = builder.leaf(rows)
+            return node
+        f, t1, t2, parts = split
+        node.split = (f, t1, t2)
+        node.counts = builder.last_counts
+        new_feats = [g for g in feats if g != f]
+        node.children = [self.grow(part, new_feats, depth + 1, builder) for part in parts]
+        return node
+
+    def encode(self, X, y):
+        """ Codes of new rows with the current encoding, or None if they need another one """
+        codes = np.empty(X.shape, dtype=np.int32)
+        for f, values in enumerate(self.values):
+            index = np.minimum(np.searchsorted(values, X[:, f]), len(values) - 1)
+            if len(X) and (values[index] != X[:, f]).any():
+                return None
+            codes[:, f] = index
+        y_index = np.minimum(np.searchsorted(self.classes, y), len(self.classes) - 1)
+        if len(y) and (self.classes[y_index] != y).any():
+            return None
+        return codes, y_index.astype(np.int64)
+
+    def append(self, X, y, codes, y_codes):
+        """ Adds the rows to the arrays (growing them by doubling); returns their indices """
+        n, m = self.n, len(y)
+        if n + m > len(self.X):
+            capacity = max(2 * len(self.X), n + m)
+            for name in ('X', 'y', 'codes', 'y_codes'):
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:n] = old[:n]
+                setattr(self, name, new)
+        self.X[n:n + m] = X
+        self.y[n:n + m] = y
+        self.codes[n:n + m] = codes
+        self.y_codes[n:n + m] = y_codes
+        self.n = n + m
+        return np.arange(n, n + m)
+
+    def update(self, X, y):
+        """ Adds the labelled rows (X (N, 42) cells, y columns) and updates the tree.
+        Returns the stats of the update (also in self.last_update) """
+        start = time.perf_counter()
+        X, y = self.prepare(X, y)
+        stats = {"rows": int(len(y)), "rebuilt_subtrees": 0, "rebuilt_rows": 0, "full_rebuild": False}
+        self.last_update = stats
+        if len(y):
+            encoded = self.encode(X, y)
+            if encoded is None:
+                self.rebuild(np.concatenate([self.X[:self.n], X]), np.concatenate([self.y[:self.n], y]))
+                stats["full_rebuild"] = True
+                stats["rebuilt_rows"] = self.n
+            else:
+                rows = self.append(X, y, *encoded)
+                self.root = self.update_node(self.root, rows, self.builder(), stats)
+        stats["time"] = time.perf_counter() - start
+        return stats
+
+    def update_node(self, node, rows, builder, stats):
+        """ node with its new rows -> the updated node (the same one or a new subtree) """
+        node.chunks.append(rows)
+        if node.split is not None:
+            node.counts += class_histogram(builder.codes, builder.y_codes, rows, node.feats,
+                                           builder.n_values, builder.n_classes)
+            if self.keeps_split(node, builder):
+                f, t1, t2 = node.split
+                column = builder.values[f][builder.codes[rows, f]]
+                parts = (rows[column <= t1], rows[(column > t1) & (column <= t2)], rows[column > t2])
+                for i, part in enumerate(parts):
+                    if len(part):
+                        node.children[i] = self.update_node(node.children[i], part, builder, stats)
+                return node
+        # a leaf, or a split that is no longer good enough
+        all_rows = node.rows()
+        if node.split is not None:
+            stats["rebuilt_subtrees"] += 1
+            stats["rebuilt_rows"] += len(all_rows)
+            if node is self.root:
+                stats["full_rebuild"] = True
+        return self.grow(all_rows, node.feats, node.depth, builder)
+
+    def keeps_split(self, node, builder):
+        """ True if the split of node is still the one to use with its rows """
+        values = [builder.values[f] for f in node.feats]
+        splits = merge_scored_splits([scored_two_splits(node.counts, values)])
+        splits = [(node.feats[i], t1, t2) for i, t1, t2 in splits]
+        if splits == [node.split]:
+            return True
+        if len(splits) > 1 and node.split in splits:
+            # a tie: decided on the rows, like the builder does
+            if builder.find_split(node.rows(), node.feats) == node.split:
+                return True
+        if not self.drift or not splits:
+            return False
+        f, t1, t2 = node.split
+        best_gain = split_gain(node.counts[node.feats.index(splits[0][0])],
+                               builder.values[splits[0][0]], splits[0][1], splits[0][2])
+        gain = split_gain(node.counts[node.feats.index(f)], builder.values[f], t1, t2)
+        return best_gain - gain <= self.drift * best_gain
+
+    def tree(self):
+        """ The dict tree (same format as build_tree_arrays) """
+        builder = self.builder()
+
+        def to_dict(node):
+            if node.split is None:
+                return node.label
+            f, t1, t2 = node.split
+            return builder.node(f, t1, t2, [to_dict(child) for child in node.children])
+        return to_dict(self.root)
+
+    def compiled(self):
+        return compile_tree(self.tree(), canonical=self.canonical)
+
+    def __len__(self):
+        """ Number of rows in the tree """
+        return self.n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates a trained tree with new datasets")
+    parser.add_argument("base", help="difficulty or dataset the tree is trained on first")
+    parser.add_argument("updates", nargs="+", help="datasets (CSV) added one after the other")
+    parser.add_argument("--drift", type=float, default=0.0,
+                        help="relative gain a split may lose before its subtree is built again")
+    parser.add_argument("--check", action="store_true", help="compare with a full training at the end")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model = IncrementalTree.from_dataset(args.base, drift=args.drift)
+    print(f"base: {len(model)} rows, {time.perf_counter() - start:.2f} s")
+    for path in args.updates:
+        stats = model.update(*load_dataset(path))
+        print(f"{path}: {stats['rows']} new rows, {stats['time'] * 1000:.1f} ms, "
+              f"{stats['rebuilt_subtrees']} subtrees rebuilt ({stats['rebuilt_rows']} rows)"
+              + (", full rebuild" if stats["full_rebuild"] else ""))
+
+    if args.check:
+        start = time.perf_counter()
+        full = decision_tree_model.build_tree_arrays(model.X[:model.n], model.y[:model.n], CELL_FEATURES,
+                                                     max_depth=model.max_depth, min_samples=model.min_samples)
+        print(f"full training: {time.perf_counter() - start:.2f} s, same tree: {full == model.tree()}")
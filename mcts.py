@@ -1,37 +1,106 @@
 import random
 import math
-import copy
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from bitboard import Position, COLOR_INDEX, ROWS, COLS, mirror_move
+from rollout import positions_to_arrays, batch_rollout, DRAW
+from transposition import TranspositionTable
+from clock import forced_move
+from tree_store import TreeStore, NO_NODE
+from search_stats import SearchStats
+from solver import Solver, SolverTimeout
 
 """ hard: iterações= 1000, C=1.41
 medium: iterações=250, C=1
 easy: iterações=50, C=2 """
 
 class MCTS(object):
-    def __init__(self, state, iterations=1000, exploration_constant=1.41):
+    def __init__(self, state, iterations=1000, exploration_constant=1.41, keep_tree=False,
+                 workers=1, worker_iterations=None, rollouts_per_leaf=1, leaf_batch=1, table_size=0,
+                 time_limit_ms=None, clock=None, compact=False, store_capacity=1 << 16,
+                 collect_stats=False, solver_threshold=0, ponder=False, table_symmetric=True):
         """
-        state: estado atual do tabuleiro, passdo como argumento
+        state: não é usado (a posição é passada a bestMove); fica pelos chamadores existentes.
         iterations: número de iterações para a simulação.
         exploration_constant: constante C utilizada na fórmula UCT.
+        keep_tree: se True, a árvore é guardada entre chamadas a bestMove; a raiz avança
+                   para a jogada escolhida e, na chamada seguinte, para a resposta do adversário.
+        workers: número de processos; com mais de 1 cada processo faz uma pesquisa independente
+                 a partir da raiz (root parallelization) e as estatísticas são somadas.
+        worker_iterations: iterações de cada processo (por defeito iterations / workers).
+        rollouts_per_leaf, leaf_batch: com algum deles > 1 as simulações são feitas em lote
+                 com NumPy (rollout.py): leaf_batch folhas por lote, rollouts_per_leaf jogos por folha.
+        table_size: se > 0, usa uma tabela de transposições (transposition.py) com este número
+                 máximo de posições; a mesma posição passa a ter um só nó, também entre jogadas.
+        time_limit_ms: se dado, cada jogada pesquisa durante este tempo (ms) em vez de um número
+                 fixo de iterações.
+        clock: um GameClock (clock.py) com o tempo total do jogo; o tempo de cada jogada é
+                 decidido pelo relógio. Tem prioridade sobre time_limit_ms.
+        compact: guarda a árvore em arrays (tree_store.py) em vez de objetos Node; usa muito menos
+                 memória. Neste modo não há keep_tree, tabela de transposições nem simulações em lote.
+        store_capacity: número de nós reservados à partida no modo compact (cresce se for preciso).
+        collect_stats: se True, cada bestMove guarda um SearchStats (search_stats.py) em last_stats,
+                 com o tempo de cada fase, profundidades, simulações e visitas dos filhos da raiz.
+        solver_threshold: se > 0, as posições com este número de casas vazias ou menos são
+                 resolvidas exatamente (solver.py): na raiz a jogada vem do solver, e na árvore os
+                 nós resolvidos ficam provados (MCTS-Solver), sem mais simulações.
+        ponder: a árvore guardada (keep_tree) continua a ser pesquisada numa thread enquanto o
+                 adversário pensa (start_pondering); na jogada seguinte só são feitas as iterações
+                 que faltam para a raiz ter iterations visitas.
+        table_symmetric: com a tabela de transposições, uma posição e a sua imagem ao espelho
+                 partilham o mesmo nó (as jogadas desse nó são espelhadas quando é alcançado
+                 pela imagem ao espelho da posição em que foi criado).
         """
-        self.state = state
         self.iterations = iterations
         self.exploration_constant = exploration_constant
+        self.keep_tree = keep_tree
+        self.workers = workers
+        self.worker_iterations = worker_iterations
+        self.rollouts_per_leaf = rollouts_per_leaf
+        self.leaf_batch = leaf_batch
+        self.rng = None
+        self.table = TranspositionTable(table_size, table_symmetric) if table_size > 0 else None
+        # the moves of a node may have to be mirrored (see node_move)
+        self.symmetric = self.table is not None and self.table.symmetric
+        self.time_limit_ms = time_limit_ms
+        self.clock = clock
+        # set by stop() (e.g. from another thread): the search ends and the best move so far is used
+        self.stop_event = threading.Event()
+        # time.perf_counter() at which the running bestMove must end (see its deadline)
+        self.deadline = None
+        self.last_iterations = 0
+        self.compact = compact
+        self.store = TreeStore(store_capacity) if compact else None
+        # merged {move: (visits, wins)} of the root children of the last parallel search
+        self.root_stats = None
+        # tree kept between moves (only when keep_tree is True)
+        self.root = None
+        self.root_position = None
+        self.collect_stats = collect_stats
+        # SearchStats of the running search (None when collect_stats is False) and of the last one
+        self.stats = None
+        self.last_stats = None
+        self.solver_threshold = solver_threshold
+        self.solver = Solver() if solver_threshold > 0 else None
+        self.ponder = ponder
+        # background search of the kept tree while the opponent thinks (see start_pondering)
+        self.ponder_thread = None
+        self.pondered_iterations = 0
+
+    """ The search itself works on a bitboard Position (see bitboard.py);
+    the static helpers below keep working on the 6x7 list boards. """
 
     @staticmethod
     def get_legal_moves(state):
         """Returns a list of not full columns"""
-        moves = []
-        for col in range(7):
-            for row in range(6):
-                if state[row][col] == ' ':
-                    moves.append(col)
-                    break
-        return moves
+        return [col for col in range(7) if state[5][col] == ' ']
 
     @staticmethod
     def make_move(state, col, color):
         """Returns a new state after choosing a column to play"""
-        new_state = copy.deepcopy(state)
+        new_state = [row[:] for row in state]
         for row in range(6):
             if new_state[row][col] == ' ':
                 new_state[row][col] = color
@@ -43,27 +112,7 @@ class MCTS(object):
         """
         Verifies if there is a winner (returns "x" or "o"), if not returns "draw"
         """
-        for i in range(6):
-            for j in range(7):
-                #for each position on the board
-                if state[i][j] != ' ':
-                    token = state[i][j]
-                    # horizontal
-                    if j <= 7 - 4 and all(state[i][j+k] == token for k in range(4)):
-                        return token
-                    # vertical
-                    if i <= 6 - 4 and all(state[i+k][j] == token for k in range(4)):
-                        return token
-                    # diagonal descendente
-                    if i <= 6 - 4 and j <= 7 - 4 and all(state[i+k][j+k] == token for k in range(4)):
-                        return token
-                    # diagonal ascendente
-                    if i >= 3 and j <= 7 - 4 and all(state[i-k][j+k] == token for k in range(4)):
-                        return token
-        #if there's no winner and every position is not empty, then its a draw
-        if all(state[i][j] != ' ' for i in range(6) for j in range(7)):
-            return 'draw'
-        return None
+        return Position.from_board(state).result()
 
     @staticmethod
     def other_player(player):
@@ -71,23 +120,32 @@ class MCTS(object):
         return 'o' if player == 'x' else 'x'
 
     class Node(object):
-        def __init__(self, state, move=None, parent=None, player=None):
+        # with a symmetric transposition table: True if the node was created from the
+        # mirror image of the canonical position (its moves are in that orientation)
+        mirrored = False
+
+        def __init__(self, position, move=None, parent=None, player=None):
             """
-            state: estado atual do tabuleiro.
+            position: posição (bitboard) depois da jogada; só é usada para obter as jogadas legais,
+                      o nó não guarda uma cópia do tabuleiro.
             move: jogada (coluna) que levou a este estado (None para a raiz).
             parent: nó pai.
             player: jogador que realizou a jogada que levou a este nó.
                      Na raiz, este valor deve ser o oponente do jogador a mover.
             """
-            self.state = state
             self.move = move
             self.parent = parent
             self.children = []
-            self.untried_moves = MCTS.get_legal_moves(state)
+            # move played to reach each child; with a transposition table a child can be shared
+            # with other parents (reached by another move), so child.move is not always the move
+            self.child_moves = []
+            self.untried_moves = position.legal_moves()
             #for each node we keep track of visits and wins
             self.visits = 0
             self.wins = 0
             self.player = player  
+            # with the solver: 1, 0 or -1 once the result for player is proven (see propagate_proof)
+            self.proven = None
             
         #returns true if mcts tried every legal column
         def fully_expanded(self):
@@ -97,98 +155,739 @@ class MCTS(object):
             """Chosing the child to expand using the UCT formula"""
             best_score = -float("inf")
             best_child = None
+            log_visits = math.log(self.visits)
             for child in self.children:
+                if child.proven == -1:
+                    # proven loss for the player choosing here
+                    continue
                 win_rate = child.wins / child.visits
-                exploration = exploration_constant * math.sqrt(math.log(self.visits) / child.visits)
+                exploration = exploration_constant * math.sqrt(log_visits / child.visits)
                 score = win_rate + exploration
                 if score > best_score:
                     best_score = score
                     best_child = child
+            if best_child is None:
+                # every child is a proven loss (proven through another parent, with a transposition table)
+                return self.children[0]
             return best_child
 
-    def bestMove(self, state, player):
-        """
-        Executes and chooses the best play
-        """
-        
-        root = self.Node(state, player=self.other_player(player))
+    def advance(self, move):
+        """ Moves the kept root to the child of the given move and drops the rest of the tree.
+        If that child was never expanded the tree is discarded """
+        if self.root is None:
+            return
+        node_move = self.node_move(self.root, self.root_position, move) if self.symmetric else move
+        # on a symmetric position only one move of each mirror pair has a child (drop_mirror_moves)
+        moves = (node_move, mirror_move(node_move)) if self.symmetric and self.root_position.is_symmetric() \
+            else (node_move,)
+        self.root_position.play(move)
+        for child_move, child in zip(self.root.child_moves, self.root.children):
+            if child_move in moves:
+                child.parent = None
+                self.root = child
+                return
+        self.root = None
+
+    def get_root(self, position, player):
+        """ Returns the kept root if it matches position, else a new root.
+        The kept root is one move behind after the opponent played, so it is advanced first """
+        if self.root is not None and self.root_position.moves + 1 == position.moves:
+            for col in range(7):
+                if self.root_position.heights[col] != position.heights[col]:
+                    self.advance(col)
+                    break
+        if (self.root is not None and self.root_position.key() == position.key()
+                and self.root_position.to_move == position.to_move):
+            return self.root
+        return self.new_root(position, player)
+
+    def new_root(self, position, player):
         """ Aqui, a raiz representa o estado atual do jogo. 
         O atributo player da raiz é definido como o jogador oposto ao que queremos mover, 
         porque o nó raiz é pensado como tendo sido alcançado após a jogada do adversário. 
+        With a transposition table the node of this position is reused if it is there.
         """
-        
-        for _ in range(self.iterations):
+        if self.table is not None:
+            key, mirrored = self.table.position_key(position)
+            root = self.table.get(key)
+            if root is None:
+                root = self.Node(position, player=self.other_player(player))
+                if mirrored:
+                    root.mirrored = True
+                self.drop_mirror_moves(root, position)
+                self.table.put(key, root)
+            return root
+        return self.Node(position, player=self.other_player(player))
+
+    def node_move(self, node, position, move):
+        """ With a symmetric table a node can be reached from the mirror image of the position
+        it was created from. Converts a move of node to the orientation of position (and back,
+        mirroring twice changes nothing) """
+        if self.symmetric and position.canonical_key()[1] != node.mirrored:
+            return mirror_move(move)
+        return move
+
+    def drop_mirror_moves(self, node, position):
+        """ With a symmetric table a move and its mirror lead to the same shared node on a
+        symmetric position, so only one move of each pair is tried (like dataset_io.row_key);
+        otherwise that node would be a child twice and get twice the weight """
+        if self.symmetric and position.is_symmetric():
+            node.untried_moves = [move for move in node.untried_moves if move <= mirror_move(move)]
+
+    def root_moves(self, root, position):
+        """ Moves of the children of root, as played on position """
+        if self.symmetric:
+            return [self.node_move(root, position, move) for move in root.child_moves]
+        return root.child_moves
+
+    def bestMove(self, state, player, deadline=None):
+        """
+        Executes and chooses the best play
+        state: 6x7 board or a bitboard Position with player to move
+        deadline: a time.time() value (it can come from another process); the search, and
+        the solver, stop then and the best move found so far is played. If it has already
+        passed the move is only a forced move or a random legal one
+        """
+        if isinstance(state, Position):
+            position = state.copy()
+        else:
+            position = Position.from_board(state, player)
+
+        # the tree is ours again (the opponent's move is played on it by get_root)
+        self.stop_pondering()
+        self.stop_event.clear()
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return self.fast_move(position)
+            self.deadline = time.perf_counter() + remaining
+        budget_ms = self.time_budget(position)
+        if budget_ms is not None and self.clock is not None:
+            self.clock.start()
+        if self.collect_stats:
+            self.stats = SearchStats(self.search_mode())
+            self.stats.start()
+        if self.solver is not None:
+            self.solver.deadline = self.deadline
+        try:
+            if self.solver is not None and ROWS * COLS - position.moves <= self.solver_threshold:
+                return self.solve_root(position)
+            if self.workers > 1:
+                return self.parallel_best_move(position, player, budget_ms)
+            if self.compact:
+                return self.compact_best_move(position, player, budget_ms)
+            return self.tree_best_move(position, player, budget_ms)
+        finally:
+            self.deadline = None
+            if self.solver is not None:
+                self.solver.deadline = None
+            if budget_ms is not None and self.clock is not None:
+                self.clock.stop()
+            if self.stats is not None:
+                self.stats.stop()
+                self.last_stats = self.stats
+                self.stats = None
+
+    def solve_root(self, position):
+        """ Few empty cells left: the move comes from the exact solver, no search """
+        try:
+            move, _ = self.solver.best_move(position)
+        except SolverTimeout:
+            return self.fast_move(position)
+        if self.stats is not None:
+            self.stats.solved = True
+        # a kept tree would be out of date after this move
+        self.root = None
+        return move
+
+    def fast_move(self, position):
+        """ Move without searching (no time left): a forced move, else a random legal one """
+        # a kept tree would be out of date after this move
+        self.root = None
+        move = forced_move(position)
+        if move is None:
+            move = random.choice(position.legal_moves())
+        return move
+
+    def search_mode(self):
+        if self.workers > 1:
+            return "parallel"
+        if self.compact:
+            return "compact"
+        if self.rollouts_per_leaf > 1 or self.leaf_batch > 1:
+            return "batched"
+        return "tree"
+
+    def time_budget(self, position):
+        """ Milliseconds for this move, or None when searching a fixed number of iterations """
+        if self.clock is not None:
+            return self.clock.budget(position)
+        return self.time_limit_ms
+
+    def stop(self):
+        """ Asks a running search to end; bestMove returns the best move found so far """
+        self.stop_event.set()
+
+    def start_pondering(self, player, max_iterations):
+        """
+        Keeps searching the kept tree (the position after our last move, the opponent to
+        move) in a background thread, for at most max_iterations, until stop_pondering().
+        The tree is only touched by that thread until then; bestMove stops it first and
+        continues from the child of the opponent's move. Returns False if there is nothing
+        to ponder (no kept tree, finished game, or a mode that does not keep the tree).
+        """
+        self.stop_pondering()
+        if (self.root is None or self.root_position is None or self.workers > 1 or self.compact
+                or self.root_position.result() is not None):
+            return False
+        self.stop_event.clear()
+        self.ponder_thread = threading.Thread(
+            target=self.search, args=(self.root, self.root_position.copy(), player, max_iterations),
+            daemon=True)
+        self.ponder_thread.start()
+        return True
+
+    def stop_pondering(self):
+        """ Ends the background search (if any) and waits for it; returns its iterations """
+        if self.ponder_thread is None:
+            return 0
+        self.stop_event.set()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.stop_event.clear()
+        self.pondered_iterations = self.last_iterations
+        return self.pondered_iterations
+
+    def tree_best_move(self, position, player, budget_ms=None):
+        if self.keep_tree:
+            root = self.get_root(position, player)
+        else:
+            root = self.new_root(position, player)
+
+        best_move = None
+        if budget_ms is not None:
+            # with a clock there is no need to search when there is no real choice
+            best_move = forced_move(position)
+            if best_move is None:
+                self.search(root, position, player, None, time.perf_counter() + budget_ms / 1000)
+            elif self.stats is not None:
+                self.stats.forced = True
+        else:
+            iterations = self.iterations
+            if self.ponder and root.children:
+                # the visits of the root done while pondering count: only the rest is searched
+                iterations = max(0, iterations - root.visits)
+            self.search(root, position, player, iterations)
+
+        moves = self.root_moves(root, position)
+        if self.stats is not None:
+            self.stats.set_root({move: (child.visits, child.wins)
+                                 for move, child in zip(moves, root.children)})
+        if best_move is None and self.solver is not None:
+            best_move = self.proven_best_move(root, moves)
+        if best_move is None:
+            #To choose a move, we select the child of the root node with the most visits
+            visits = [child.visits for child in root.children]
+            best_move = moves[visits.index(max(visits))]
+
+        if self.keep_tree:
+            # the visits of the chosen subtree are reused on the next move
+            self.root = root
+            self.root_position = position
+            self.advance(best_move)
+        return best_move
+
+    def proven_best_move(self, root, moves=None):
+        """ With the solver: a proven win if there is one, else the most visited move
+        that is not a proven loss (None if there is nothing to choose from).
+        moves: the moves of the children of root (by default root.child_moves) """
+        candidates = []
+        for move, child in zip(root.child_moves if moves is None else moves, root.children):
+            if child.proven == 1:
+                return move
+            if child.proven != -1:
+                candidates.append((child.visits, move))
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    def compact_best_move(self, position, player, budget_ms=None):
+        if budget_ms is not None:
+            move = forced_move(position)
+            if move is not None:
+                if self.stats is not None:
+                    self.stats.forced = True
+                return move
+            stats = self.search_compact(position, player, None, time.perf_counter() + budget_ms / 1000)
+        else:
+            stats = self.search_compact(position, player, self.iterations)
+        if self.stats is not None:
+            self.stats.iterations = self.last_iterations
+            self.stats.nodes = self.store.size
+            self.stats.set_root(stats)
+        return max(stats, key=lambda move: stats[move][0])
+
+    def parallel_best_move(self, position, player, budget_ms=None):
+        """
+        Root parallelization: each worker process runs an independent search from the same
+        root with its own seed, then the visits and wins of the root children are summed
+        and the move with the most visits is chosen.
+        The tree is not kept between moves in this mode.
+        """
+        if budget_ms is not None:
+            move = forced_move(position)
+            if move is not None:
+                if self.stats is not None:
+                    self.stats.forced = True
+                return move
+            worker_iterations = None
+        else:
+            worker_iterations = self.worker_iterations or -(-self.iterations // self.workers)
+        seed = random.getrandbits(32)
+        pool = get_pool(self.workers)
+        stop_ms = (self.deadline - time.perf_counter()) * 1000 if self.deadline is not None else None
+        jobs = [pool.submit(_root_search, position, player, worker_iterations,
+                            self.options(), seed + i, budget_ms, stop_ms)
+                for i in range(self.workers)]
+
+        visits = {}
+        wins = {}
+        for job in jobs:
+            for move, (child_visits, child_wins) in job.result().items():
+                visits[move] = visits.get(move, 0) + child_visits
+                wins[move] = wins.get(move, 0) + child_wins
+        self.root_stats = {move: (visits[move], wins[move]) for move in visits}
+        if self.stats is not None:
+            # each visit of a root child is one iteration of a worker
+            self.stats.iterations = sum(visits.values())
+            self.stats.set_root(self.root_stats)
+        return max(visits, key=visits.get)
+
+    def search(self, root, position, player, iterations, deadline=None):
+        """
+        Runs the iterations from root; position must be the position of the root
+        (it is left unchanged at the end).
+        iterations can be None when there is a deadline (a time.perf_counter() value): the
+        search then runs until it; stop() also ends it. At least one iteration is always done.
+        """
+        if self.rollouts_per_leaf > 1 or self.leaf_batch > 1:
+            self.search_batched(root, position, player, iterations, deadline)
+            if self.stats is not None:
+                self.stats.iterations += self.last_iterations
+                self.stats.nodes = None  # not counted in this mode
+            return
+        if self.stats is not None:
+            return self.search_profiled(root, position, player, iterations, deadline)
+
+        # full check only once for the root, the rest of the search checks only the last move
+        root_result = position.result()
+
+        done = 0
+        while iterations is None or done < iterations:
             """ vai realizar iterações porque esse é o valor passado no construtor
-             em cada iteração, realiza seleção, expansão, simulação e retropropagação """
-            
-            node = root
-            state_copy = copy.deepcopy(state)
-            
-            #SELECTION 
-            """ só entra no loop se o nó estiver totalmente expandido
-            caso entre: seleciona o melhor filho, atualiza o estado
-            com a jogada escolhida no filho e "node"""
-            while node.fully_expanded() and self.game_result(state_copy) is None:
-                node = node.best_child(self.exploration_constant)
-                # Determina o jogador que fez a jogada neste nó.
-                move_player = self.other_player(node.parent.player) if node.parent else player
-                state_copy = self.make_move(state_copy, node.move, move_player)
+             em cada iteração, realiza seleção, expansão, simulação e retropropagação.
+             As jogadas são feitas sobre a mesma posição e desfeitas (undo) no fim da iteração,
+             em vez de copiar o tabuleiro a cada jogada """
+
+            # the clock is only read every 16 iterations
+            if done & 15 == 0 and done and self.should_stop(deadline):
+                break
+            if root.proven is not None:
+                # nothing left to learn: the result of the root is known
+                break
+            done += 1
             
-            # EXPANSION
-            """ 
-            se o estado atual nao for terminal e ainda houver movimentos não explorados
-            (node.untried_moves), o algoritmo escolhe aleatoriamente um desses moves
-            e cria um novo nó (filho) na árvore.
-            -> se já tiver tentado todos os moves, deixa de fazer expansão e vai para o prox passo
-            """
-            if self.game_result(state_copy) is None and node.untried_moves:
-                move = random.choice(node.untried_moves)
-                new_state = self.make_move(state_copy, move, self.other_player(node.player))
-                child_node = self.Node(new_state, move=move, parent=node, player=self.other_player(node.player))
-                node.untried_moves.remove(move)
-                node.children.append(child_node)
-                node = child_node #a simulação vai começar a partir deste novo nó
+            path, plies, result = self.select_and_expand(root, position, root_result)
             
             # SIMULATION (Rollout)
             """ 
-            simula uma sequência de jogadas aleatórias até que o jogo termine
-            -> cria uma copia (rollout_state) para preservar o estado original da árvore
+            simula uma sequência de jogadas aleatórias até que o jogo termine,
+            sobre a mesma posição (as jogadas são desfeitas depois)
             """
-            rollout_state = copy.deepcopy(state_copy)
-            current_player = self.other_player(node.player) #player that makes the next move
-            result = self.game_result(rollout_state)
             while result is None:
-                legal_moves = self.get_legal_moves(rollout_state)
-                if not legal_moves:
-                    result = 'draw'
-                    break
-                move = random.choice(legal_moves)
-                rollout_state = self.make_move(rollout_state, move, current_player)
-                current_player = self.other_player(current_player)
-                result = self.game_result(rollout_state)
-            
-            # Define a recompensa do ponto de vista do jogador que queremos mover
-            if result == player:
-                reward = 1
-            elif result == 'draw':
-                reward = 0.5
+                position.play(random.choice(position.legal_moves()))
+                plies += 1
+                result = position.last_move_result()
+
+            for _ in range(plies):
+                position.undo()
+
+            #BACKPROPAGATION
+            self.backpropagate(path, player, self.reward(result, player))
+        self.last_iterations = done
+
+    def search_profiled(self, root, position, player, iterations, deadline=None):
+        """
+        The loop of search with the time of each phase and the depths and rollout
+        lengths added to self.stats (kept apart so search itself has no extra cost)
+        """
+        stats = self.stats
+        phase_times = stats.phase_times
+        clock = time.perf_counter
+        root_result = position.result()
+
+        done = 0
+        while iterations is None or done < iterations:
+            if done & 15 == 0 and done and self.should_stop(deadline):
+                break
+            if root.proven is not None:
+                break
+            done += 1
+
+            t0 = clock()
+            node, path, plies, result = self.select(root, position, root_result)
+            t1 = clock()
+            if result is None and node.untried_moves:
+                result, created = self.expand(node, path, position)
+                plies += 1
+                stats.nodes += created
+            t2 = clock()
+
+            depth = plies
+            while result is None:
+                position.play(random.choice(position.legal_moves()))
+                plies += 1
+                result = position.last_move_result()
+            for _ in range(plies):
+                position.undo()
+            t3 = clock()
+
+            self.backpropagate(path, player, self.reward(result, player))
+            t4 = clock()
+
+            phase_times["selection"] += t1 - t0
+            phase_times["expansion"] += t2 - t1
+            phase_times["rollout"] += t3 - t2
+            phase_times["backpropagation"] += t4 - t3
+            stats.add_leaf(depth, plies - depth)
+        self.last_iterations = done
+        stats.iterations += done
+
+    def should_stop(self, deadline):
+        """ deadline: end of the time budget of the search; self.deadline: the one of bestMove """
+        if self.stop_event.is_set():
+            return True
+        if deadline is None and self.deadline is None:
+            return False
+        now = time.perf_counter()
+        return (deadline is not None and now >= deadline) or (self.deadline is not None and now >= self.deadline)
+
+    @staticmethod
+    def reward(result, player):
+        """ Recompensa do resultado de um jogo do ponto de vista do jogador que queremos mover """
+        if result == player:
+            return 1
+        if result == 'draw':
+            return 0.5
+        return 0
+
+    def backpropagate(self, path, player, reward, visit=True):
+        """ Segue o caminho percorrido nesta iteração (e não node.parent), porque com
+        a tabela de transposições um nó pode ter vários pais.
+        visit=False quando as visitas já foram contadas (a virtual loss das simulações em lote) """
+        for node in path:
+            if visit:
+                node.visits += 1
+            if node.player == player:  # a node of our player gets the reward, the others the opposite
+                node.wins += reward
             else:
-                reward = 0
-            
+                node.wins += 1 - reward
+        if path[-1].proven is not None:
+            self.propagate_proof(path)
+
+    def select_and_expand(self, root, position, root_result):
+        """
+        Selection and expansion of one iteration. The moves are played on position;
+        returns (path of nodes from the root to the leaf, plies played, result of the leaf)
+        """
+        node, path, plies, result = self.select(root, position, root_result)
+        if result is None and node.untried_moves:
+            result, _ = self.expand(node, path, position)
+            plies += 1
+        return path, plies, result
+
+    def select(self, root, position, root_result):
+        """ Follows the UCT choices from root while the nodes are fully expanded;
+        returns (last node, path, plies played, result of the last node) """
+        node = root
+        path = [root]
+        plies = 0
+        result = root_result
+        
+        #SELECTION 
+        """ só entra no loop se o nó estiver totalmente expandido
+        caso entre: seleciona o melhor filho, atualiza o estado
+        com a jogada escolhida no filho e "node"""
+        while node.fully_expanded() and result is None and node.proven is None:
+            child = node.best_child(self.exploration_constant)
+            move = node.child_moves[node.children.index(child)]
+            if self.symmetric:
+                move = self.node_move(node, position, move)
+            position.play(move)
+            node = child
+            path.append(node)
+            plies += 1
+            result = position.last_move_result()
+        if result is None and node.proven is not None:
+            # a proven node is a leaf: its result is known, no rollout
+            result = self.proven_result(node)
+        return node, path, plies, result
+
+    def expand(self, node, path, position):
+        """ Plays one untried move of node and adds its child to the tree and to path;
+        returns (result of the new position, True if a new node was created) """
+        # EXPANSION
+        """ 
+        se o estado atual nao for terminal e ainda houver movimentos não explorados
+        (node.untried_moves), o algoritmo escolhe aleatoriamente um desses moves
+        e cria um novo nó (filho) na árvore.
+        -> se já tiver tentado todos os moves, deixa de fazer expansão e vai para o prox passo
+        """
+        move = random.choice(node.untried_moves)
+        played = self.node_move(node, position, move) if self.symmetric else move
+        position.play(played)
+        child_node = None
+        if self.table is not None:
+            # the same position reached by another order of moves (or its mirror image): share its node
+            key, mirrored = self.table.position_key(position)
+            child_node = self.table.get(key)
+        created = child_node is None
+        if created:
+            child_node = self.Node(position, move=played, parent=node, player=self.other_player(node.player))
+            if self.table is not None:
+                if mirrored:
+                    child_node.mirrored = True
+                self.drop_mirror_moves(child_node, position)
+                self.table.put(key, child_node)
+        node.untried_moves.remove(move)
+        node.children.append(child_node)
+        node.child_moves.append(move)
+        path.append(child_node) #a simulação vai começar a partir deste novo nó
+        result = position.last_move_result()
+        if self.solver is not None and child_node.proven is None:
+            if result is not None:
+                # the player of the node made 4 in a row (or filled the board)
+                child_node.proven = 0 if result == 'draw' else 1
+            elif ROWS * COLS - position.moves <= self.solver_threshold:
+                try:
+                    child_node.proven = -self.solver.solve(position)
+                    result = self.proven_result(child_node)
+                except SolverTimeout:
+                    # the deadline of bestMove: the leaf is left unproven, the search ends anyway
+                    pass
+        elif child_node.proven is not None and result is None:
+            result = self.proven_result(child_node)
+        return result, created
+
+    def proven_result(self, node):
+        """ Result ('x', 'o' or 'draw') of a proven node """
+        if node.proven == 0:
+            return 'draw'
+        return node.player if node.proven == 1 else self.other_player(node.player)
+
+    def propagate_proof(self, path):
+        """
+        MCTS-Solver: the leaf of path is proven; its parents become proven too when
+        the player choosing there has a proven win (the parent is lost for its player)
+        or when all their moves are proven (the parent gets the best of them, negated).
+        """
+        for i in range(len(path) - 2, -1, -1):
+            node = path[i]
+            if node.proven is not None:
+                break
+            child = path[i + 1]
+            if child.proven == 1:
+                node.proven = -1
+            elif node.untried_moves or any(c.proven is None for c in node.children):
+                break
+            else:
+                node.proven = -max(c.proven for c in node.children)
+
+    def search_batched(self, root, position, player, iterations, deadline=None):
+        """
+        Same search, but the rollouts are done with the NumPy kernel of rollout.py:
+        leaf_batch leaves are selected first (with a virtual loss, so they are not all the same
+        leaf), then rollouts_per_leaf random games are played from each of them in one batch,
+        and the average result of each leaf is backpropagated as one visit.
+        It only pays off with about 1000 games per batch (leaf_batch * rollouts_per_leaf):
+        with leaf_batch=64, rollouts_per_leaf=16, benchmark.py --quick measures 8-14x the
+        rollouts/s of search (opening 13k -> 187k, endgame 67k -> 634k, one core), but fewer
+        iterations per second, since each visit costs rollouts_per_leaf games.
+        leaf_batch=16, rollouts_per_leaf=8 only gives about 2-3.5x.
+        """
+        if self.rng is None:
+            self.rng = np.random.default_rng(random.getrandbits(32))
+        root_result = position.result()
+
+        done = 0
+        while iterations is None or done < iterations:
+            if done and self.should_stop(deadline) or root.proven is not None:
+                break
+            batch = self.leaf_batch if iterations is None else min(self.leaf_batch, iterations - done)
+            leaves = self.select_leaves(root, position, root_result, batch)
+            done += len(leaves)
+            scores = self.rollout_scores([leaf for _, leaf, result in leaves if result is None])
+            self.backpropagate_leaves(leaves, player, iter(scores))
+        self.last_iterations = done
+
+    def select_leaves(self, root, position, root_result, batch):
+        """ Selects (and expands) up to batch leaves from root, with a virtual loss.
+        Returns [(path, copy of the leaf position or None, result)]; position is left unchanged """
+        leaves = []
+        for _ in range(batch):
+            path, plies, result = self.select_and_expand(root, position, root_result)
+            leaves.append((path, position.copy() if result is None else None, result))
+            for _ in range(plies):
+                position.undo()
+            # virtual loss: the visit is counted now (without the win), so the next
+            # selections of this batch see this path as worse and try other leaves
+            for node in path:
+                node.visits += 1
+            if root.proven is not None:
+                break
+        return leaves
+
+    def rollout_scores(self, positions):
+        """ rollouts_per_leaf random games from each position, all in one NumPy batch.
+        Returns the average result of each position for 'x' (1 win, 0.5 draw, 0 loss) """
+        if not positions:
+            return []
+        masks, heights, to_move = positions_to_arrays(positions)
+        k = self.rollouts_per_leaf
+        winners = batch_rollout(np.repeat(masks, k, axis=0), np.repeat(heights, k, axis=0),
+                                np.repeat(to_move, k), self.rng).reshape(len(positions), k)
+        return ((winners == COLOR_INDEX['x']) + 0.5 * (winners == DRAW)).mean(axis=1).tolist()
+
+    def backpropagate_leaves(self, leaves, player, scores):
+        """ Backpropagates the leaves of select_leaves; scores: iterator over the rollout_scores
+        of the leaves that were not finished (the visits were already counted) """
+        for path, leaf, result in leaves:
+            if result is None:
+                reward = next(scores)
+                if player != 'x':
+                    reward = 1 - reward
+            else:
+                reward = self.reward(result, player)
             #BACKPROPAGATION
-            while node is not None:
-                node.visits += 1 #increase the number of visits
+            self.backpropagate(path, player, reward, visit=False)
+
+    def search_compact(self, position, player, iterations, deadline=None):
+        """
+        The same search on the arrays of a TreeStore (node 0 is the root).
+        Expanding a node creates all its children at once with 0 visits; the children
+        with 0 visits are the untried moves. Returns {move: (visits, wins)} of the root children.
+        """
+        store = self.store
+        store.add_root()
+        visits = store.visits
+        wins = store.wins
+        root_result = position.result()
+        c = self.exploration_constant
+
+        done = 0
+        while iterations is None or done < iterations:
+            if done & 15 == 0 and done and self.should_stop(deadline):
+                break
+            done += 1
+            # the buffers can be replaced when the store grows
+            visits = store.visits
+            wins = store.wins
+
+            node = 0
+            plies = 0
+            depth = 0
+            result = root_result
+            #SELECTION and EXPANSION
+            while result is None:
+                if store.num_children[node] == 0:
+                    store.expand(node, position.legal_moves())
+                    visits = store.visits
+                    wins = store.wins
+                children = store.children(node)
+                # each visit of a node after its first one tries one more child,
+                # so there can only be untried children while visits <= number of children
+                untried = None
+                if visits[node] <= len(children):
+                    untried = [child for child in children if visits[child] == 0]
+                if untried:
+                    node = random.choice(untried)
+                    position.play(store.move[node])
+                    plies += 1
+                    depth += 1
+                    result = position.last_move_result()
+                    break
+                log_visits = math.log(visits[node])
+                best_score = -float("inf")
+                for child in children:
+                    score = wins[child] / visits[child] + c * math.sqrt(log_visits / visits[child])
+                    if score > best_score:
+                        best_score = score
+                        node = child
+                position.play(store.move[node])
+                plies += 1
+                depth += 1
+                result = position.last_move_result()
+
+            # SIMULATION (Rollout)
+            while result is None:
+                position.play(random.choice(position.legal_moves()))
+                plies += 1
+                result = position.last_move_result()
+            for _ in range(plies):
+                position.undo()
 
-                if node.player == player: #if it is a node of our player: give the reward calculated before
-                    node.wins += reward
+            reward = self.reward(result, player)
+
+            #BACKPROPAGATION: the nodes at an odd depth are moves of player
+            while node != NO_NODE:
+                visits[node] += 1
+                if depth & 1:
+                    wins[node] += reward
                 else:
-                    node.wins += 1 - reward  #else, give the opposite reward
-                node = node.parent
+                    wins[node] += 1 - reward
+                depth -= 1
+                node = store.parent[node]
+        self.last_iterations = done
 
-        
-        #To choose a move, we select the child of the root node with the most visits
-        best_child = max(root.children, key=lambda c: c.visits)
-        return best_child.move
-    
+        if store.num_children[0] == 0:
+            return {}
+        return {store.move[child]: (visits[child], wins[child]) for child in store.children(0)}
+
+    def options(self):
+        """ Search settings, used to build the same MCTS in the worker processes """
+        return {"exploration_constant": self.exploration_constant,
+                "rollouts_per_leaf": self.rollouts_per_leaf,
+                "leaf_batch": self.leaf_batch,
+                "table_size": self.table.capacity if self.table is not None else 0,
+                "compact": self.compact,
+                "solver_threshold": self.solver_threshold,
+                "table_symmetric": self.table.symmetric if self.table is not None else True}
+
+
+# worker pools are kept alive between moves, so the processes are only started once
+_pools = {}
+
+
+def get_pool(workers):
+    """ Returns the persistent process pool with that number of workers """
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        _pools[workers] = pool
+    return pool
 
 
+def _root_search(position, player, iterations, options, seed, budget_ms=None, stop_ms=None):
+    """ Runs in a worker: one independent search, returns {move: (visits, wins)} of the root children.
+    With budget_ms the worker searches for that time instead of a number of iterations;
+    stop_ms is the time left before the deadline of bestMove """
+    random.seed(seed)
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms is not None else None
+    mc = MCTS(position, iterations, **options)
+    if stop_ms is not None:
+        mc.deadline = time.perf_counter() + stop_ms / 1000
+    if mc.compact:
+        return mc.search_compact(position, player, iterations, deadline)
+    root = mc.new_root(position, player)
+    mc.search(root, position, player, iterations, deadline)
+    return {move: (child.visits, child.wins) for move, child in zip(mc.root_moves(root, position), root.children)}
@@ -0,0 +1,107 @@
+""" On-disk cache of the trained decision trees.
+
+Training a tree reads the whole CSV and runs ID3 on it, so AIPlayer_DT loads the tree
+from here when it was already trained. An entry is a JSON file with the dict tree,
+named after the difficulty, a hash of the content of the dataset and the training
+hyperparameters. If the dataset or MAX_DEPTH/MIN_SAMPLES/CANONICAL change the name changes too,
+the old entries of that difficulty are deleted and the tree is trained again.
+"""
+import os
+import json
+import hashlib
+import decision_tree_model
+from compiled_tree import compile_tree
+from dataset_io import dataset_files
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_cache")
+
+# bump when the format of the stored trees changes
+FORMAT_VERSION = 1
+
+
+def dataset_hash(path):
+    """ sha256 of the content of the files the dataset is loaded from """
+    digest = hashlib.sha256()
+    for name in dataset_files(path):
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hyperparameters():
+    """ Training settings that change the tree (read when called, so changes to the
+    module globals are seen) """
+    return {"max_depth": decision_tree_model.MAX_DEPTH,
+            "min_samples": decision_tree_model.MIN_SAMPLES,
+            "canonical": decision_tree_model.CANONICAL}
+
+
+def entry_name(difficulty, data_hash, params):
+    """ File name of the entry: difficulty-<hash>-<hash of the settings>.json """
+    settings = json.dumps(dict(params, version=FORMAT_VERSION), sort_keys=True)
+    params_hash = hashlib.sha256(settings.encode()).hexdigest()[:12]
+    return f"{difficulty}-{data_hash[:16]}-{params_hash}.json"
+
+
+def _prune(directory, difficulty, keep):
+    """ Deletes the entries of this difficulty other than keep """
+    prefix = difficulty + "-"
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(".json") and name != keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def load_tree(path):
+    """ Returns the dict tree stored in path, or None if it can not be read """
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("version") != FORMAT_VERSION:
+        return None
+    return entry["tree"]
+
+
+def save_tree(path, tree, meta):
+    """ Writes to a temporary file first, so a crash never leaves a broken entry """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(dict(meta, version=FORMAT_VERSION, tree=tree), f)
+    os.replace(tmp, path)
+
+
+def load_or_train(difficulty, directory=None):
+    """ Returns the dict tree of this difficulty, training (and storing) it only
+    if there is no valid entry in the cache """
+    directory = CACHE_DIR if directory is None else directory
+    dataset = decision_tree_model.DATASETS[difficulty]
+    data_hash = dataset_hash(dataset)
+    params = hyperparameters()
+    name = entry_name(difficulty, data_hash, params)
+    path = os.path.join(directory, name)
+
+    tree = load_tree(path) if os.path.exists(path) else None
+    if tree is not None:
+        return tree
+
+    tree = decision_tree_model.train_tree(difficulty)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        save_tree(path, tree, {"difficulty": difficulty, "dataset": dataset,
+                               "dataset_sha256": data_hash, "params": params})
+        _prune(directory, difficulty, name)
+    except OSError as e:
+        # not being able to cache is not an error, the tree is still returned
+        print(f"Could not save the model cache: {e}")
+    return tree
+
+
+def load_compiled(difficulty, directory=None):
+    """ (dict tree, CompiledTree) of this difficulty """
+    tree = load_or_train(difficulty, directory)
+    return tree, compile_tree(tree, canonical=decision_tree_model.CANONICAL)
@@ -0,0 +1,146 @@
+""" Opening book: the best move of every position of the first plies, found offline
+with long MCTS searches, so the players answer them at once.
+
+Positions are stored by Position.canonical_key(): a position and its mirror image
+share one entry (the move is mirrored back on lookup). key() only depends on the
+pieces of the player to move and of the opponent, not on their colors, so the book
+works for both colors and for games started by 'o'.
+
+The file is a .npy with one sorted uint64 per position, key << 3 | move (the move
+fits in 3 bits), loaded memory-mapped and searched with np.searchsorted.
+
+    python opening_book.py --plies 4 --iterations 20000 --workers 8
+"""
+import os
+import random
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from bitboard import Position, COLS
+from mcts import MCTS
+
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.npy")
+
+MOVE_BITS = 3
+
+
+class OpeningBook(object):
+
+    def __init__(self, table):
+        self.table = table
+
+    @classmethod
+    def load(cls, path=BOOK_FILE, mmap=True):
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    @classmethod
+    def from_entries(cls, entries):
+        """ entries: {canonical key: move} """
+        table = np.array(sorted((key << MOVE_BITS) | move for key, move in entries.items()),
+                         dtype=np.uint64)
+        return cls(table)
+
+    def save(self, path=BOOK_FILE):
+        np.save(path, np.asarray(self.table, dtype=np.uint64))
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, position):
+        """ Book move of the position, or None if it is not in the book """
+        key, mirrored = position.canonical_key()
+        i = int(np.searchsorted(self.table, np.uint64(key << MOVE_BITS)))
+        if i == len(self.table):
+            return None
+        entry = int(self.table[i])
+        if entry >> MOVE_BITS != key:
+            return None
+        move = entry & ((1 << MOVE_BITS) - 1)
+        return COLS - 1 - move if mirrored else move
+
+
+_default_book = False
+
+
+def default_book():
+    """ The book of BOOK_FILE (loaded once per process), or None if there is no book """
+    global _default_book
+    if _default_book is False:
+        _default_book = OpeningBook.load() if os.path.exists(BOOK_FILE) else None
+    return _default_book
+
+
+def book_move(book, position):
+    """ Legal book move of the position, or None """
+    if book is None:
+        return None
+    move = book.lookup(position)
+    if move is None or not position.can_play(move):
+        return None
+    return move
+
+
+def book_positions(plies):
+    """ One position per canonical key, for every unfinished position with up to plies
+    moves (from the empty board). Returns [(canonical key, mirrored, moves played)] """
+    positions = []
+    level = {}
+    start = Position()
+    key, mirrored = start.canonical_key()
+    level[key] = (mirrored, start)
+    for ply in range(plies + 1):
+        positions.extend((key, mirrored, p.history[:]) for key, (mirrored, p) in level.items())
+        if ply == plies:
+            break
+        following = {}
+        for _, position in level.values():
+            for move in position.legal_moves():
+                child = position.copy()
+                child.play(move)
+                if child.last_move_result() is not None:
+                    continue
+                key, mirrored = child.canonical_key()
+                if key not in following:
+                    following[key] = (mirrored, child)
+        level = following
+    return positions
+
+
+def _search(moves, iterations, c, seed):
+    """ Runs in a worker: best move of the position after moves """
+    random.seed(seed)
+    position = Position()
+    for move in moves:
+        position.play(move)
+    return MCTS(None, iterations, c).bestMove(position, position.color)
+
+
+def build_book(plies=4, iterations=20000, c=1.41, workers=None, seed=0):
+    positions = book_positions(plies)
+    jobs = [(moves, iterations, c, seed + i) for i, (_, _, moves) in enumerate(positions)]
+    if workers == 1:
+        moves = [_search(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            moves = list(pool.map(_search, *zip(*jobs)))
+    entries = {}
+    for (key, mirrored, _), move in zip(positions, moves):
+        # the move of the canonical orientation
+        entries[key] = COLS - 1 - move if mirrored else move
+    return OpeningBook.from_entries(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the opening book")
+    parser.add_argument("--plies", type=int, default=4, help="positions with up to this many moves")
+    parser.add_argument("--iterations", type=int, default=20000, help="MCTS iterations per position")
+    parser.add_argument("--c", type=float, default=1.41)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BOOK_FILE)
+    args = parser.parse_args()
+
+    print(f"{len(book_positions(args.plies))} positions")
+    book = build_book(args.plies, args.iterations, args.c, args.workers, args.seed)
+    book.save(args.output)
+    print(f"{len(book)} entries written to {args.output}")
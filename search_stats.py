@@ -0,0 +1,96 @@
+""" Statistics of one MCTS search (one bestMove), collected when MCTS is created with
+collect_stats=True.
+
+With the object tree and one rollout per leaf (the default search), the time of each
+phase and the depths and rollout lengths are measured inside the search loop; that
+loop is a separate copy of MCTS.search, so the normal search has no extra cost when
+stats are off. The other modes (compact, batched, parallel) only report the totals,
+the number of nodes and the visits of the root children.
+"""
+import time
+
+
+class SearchStats(object):
+    """ Counters of one search. Times are in seconds """
+
+    PHASES = ("selection", "expansion", "rollout", "backpropagation")
+
+    def __init__(self, mode="tree"):
+        self.mode = mode
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)
+        self.total_time = 0.0
+        self.iterations = 0
+        self.nodes = 0              # nodes created by this search (None if not counted)
+        self.max_depth = 0          # depth (from the root) of the deepest leaf reached
+        self.depth_sum = 0
+        self.rollouts = 0
+        self.rollout_plies = 0
+        self.max_rollout_plies = 0
+        self.root_visits = {}       # move -> visits of the root child
+        self.root_wins = {}
+        self.forced = False         # the move was played without searching
+        self.solved = False         # the move came from the exact solver
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def add_leaf(self, depth, rollout_plies):
+        """ One iteration that reached a leaf at depth and played rollout_plies random moves """
+        self.depth_sum += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if rollout_plies:
+            self.rollouts += 1
+            self.rollout_plies += rollout_plies
+            if rollout_plies > self.max_rollout_plies:
+                self.max_rollout_plies = rollout_plies
+
+    def set_root(self, stats):
+        """ stats: {move: (visits, wins)} of the root children """
+        self.root_visits = {move: visits for move, (visits, _) in stats.items()}
+        self.root_wins = {move: wins for move, (_, wins) in stats.items()}
+
+    def average_depth(self):
+        return self.depth_sum / self.iterations if self.iterations and self.depth_sum else 0.0
+
+    def average_rollout_plies(self):
+        return self.rollout_plies / self.rollouts if self.rollouts else 0.0
+
+    def iterations_per_second(self):
+        return self.iterations / self.total_time if self.total_time else 0.0
+
+    def to_dict(self):
+        return {"mode": self.mode, "forced": self.forced, "solved": self.solved,
+                "total_time": self.total_time,
+                "phase_times": dict(self.phase_times),
+                "iterations": self.iterations,
+                "iterations_per_second": self.iterations_per_second(),
+                "nodes": self.nodes,
+                "max_depth": self.max_depth,
+                "average_depth": self.average_depth(),
+                "rollouts": self.rollouts,
+                "average_rollout_plies": self.average_rollout_plies(),
+                "max_rollout_plies": self.max_rollout_plies,
+                "root_visits": dict(self.root_visits)}
+
+    def summary(self):
+        """ One line for the logs """
+        if self.forced:
+            return "forced move, no search"
+        if self.solved:
+            return f"solved exactly in {self.total_time * 1000:.1f} ms"
+        text = (f"{self.iterations} it in {self.total_time * 1000:.1f} ms "
+                f"({self.iterations_per_second():.0f}/s)")
+        if self.nodes is not None:
+            text += f", {self.nodes} nodes"
+        if any(self.phase_times.values()):
+            phases = ", ".join(f"{phase} {100 * t / self.total_time:.0f}%"
+                               for phase, t in self.phase_times.items()) if self.total_time else ""
+            text += (f", depth avg {self.average_depth():.1f} max {self.max_depth}, "
+                     f"rollout avg {self.average_rollout_plies():.1f} plies; {phases}")
+        visits = " ".join(f"{move}:{self.root_visits[move]}" for move in sorted(self.root_visits))
+        return f"{text}; root visits {visits}"
@@ -0,0 +1,241 @@
+""" Generation of training datasets by MCTS self-play.
+
+Worker processes play MCTS-vs-MCTS games and send back every position with the move
+that was chosen in it. This process removes the duplicates and appends the new rows
+to CSV shards with the same format as mcts_dataset_*.csv (42 cells and the column),
+so they can be used with dataset_io / train_tree directly.
+
+Duplicates are found with a 64-bit key per (board, move): the board takes 49 bits (see
+dataset_io.row_key) and the move 3, so the keys are exact, not hashes that can collide. The key is
+the one of the canonical form, so the mirror image of a row (mirrored board, mirrored
+move) is a duplicate too. They are
+kept in a sorted NumPy array (8 bytes per row) or, with a Bloom filter, in about
+10 bits per row at the cost of dropping a few new rows as false positives.
+
+Game i is played with seed + i, so the output only depends on the settings. A
+manifest in the output directory records the games done and the size of each shard
+after the last batch; running again with the same directory continues from there
+(rows written after the last manifest update are cut off).
+
+    python selfplay.py out_dir --games 100000 --iterations 1000 --workers 8
+"""
+import os
+import csv
+import json
+import random
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from bitboard import Position, COLORS
+from mcts import MCTS
+from dataset_io import parse_csv, row_key, rows_to_keys, KeySet
+
+MANIFEST = "manifest.json"
+CELLS = (' ', 'x', 'o')
+
+
+def _mix(key, salt):
+    """ splitmix64 of key + salt, used as the hash functions of the Bloom filter """
+    z = (key + salt * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return z ^ (z >> 31)
+
+
+class BloomFilter(object):
+    """ Approximate set for capacity keys with about error_rate false positives
+    ("already seen" for a new key); never false negatives """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.n_bits = max(64, int(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * np.log(2))))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _indices(self, key):
+        h1 = _mix(key, 1)
+        h2 = _mix(key, 2) | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._indices(key))
+
+    def add(self, key):
+        for i in self._indices(key):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def update(self, keys):
+        for key in keys:
+            self.add(int(key))
+
+    def merge(self):
+        pass
+
+
+def play_game(iterations, c, seed, opening_moves=0):
+    """ Runs in a worker: one self-play game. 'x' starts the even seeds and 'o' the odd ones.
+    The first opening_moves moves are random and not recorded (more varied games).
+    Returns [(42 cells, move, row key)] of the recorded moves """
+    random.seed(seed)
+    position = Position(COLORS[seed % 2])
+    searches = [MCTS(None, iterations, c, keep_tree=True) for _ in COLORS]
+    rows = []
+    while position.result() is None:
+        if position.moves < opening_moves:
+            move = random.choice(position.legal_moves())
+        else:
+            move = searches[position.to_move].bestMove(position, position.color)
+            board = position.to_board()
+            rows.append(("".join(cell for row in board for cell in row), move, row_key(position, move)))
+        position.play(move)
+    return rows
+
+
+class SelfPlayGenerator(object):
+    """ Writes the deduplicated rows of the games to out_dir/shard-NNNNN.csv,
+    shard_rows rows per shard """
+
+    def __init__(self, out_dir, iterations=1000, c=1.41, seed=0, shard_rows=100000,
+                 bloom_capacity=None, opening_moves=0):
+        self.out_dir = out_dir
+        self.settings = {"iterations": iterations, "c": c, "seed": seed,
+                         "opening_moves": opening_moves}
+        self.shard_rows = shard_rows
+        self.seen = KeySet() if bloom_capacity is None else BloomFilter(bloom_capacity)
+        self.games_done = 0
+        self.shards = []        # [{"name", "rows", "bytes"}]
+        self.duplicates = 0
+        self.file = None
+        self.writer = None
+        os.makedirs(out_dir, exist_ok=True)
+        self._resume()
+
+    def _resume(self):
+        path = os.path.join(self.out_dir, MANIFEST)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest["settings"] != self.settings:
+            raise ValueError(f"{self.out_dir} was generated with other settings: {manifest['settings']}")
+        self.games_done = manifest["games_done"]
+        self.duplicates = manifest.get("duplicates", 0)
+        self.shards = manifest["shards"]
+        for shard in self.shards:
+            shard_path = os.path.join(self.out_dir, shard["name"])
+            # drop what was written after the last manifest update
+            with open(shard_path, 'r+b') as f:
+                f.truncate(shard["bytes"])
+            if shard["rows"]:
+                boards, moves = parse_csv(shard_path)
+                self.seen.update(rows_to_keys(boards, moves))
+        # files of shards that were created after the manifest was written
+        names = {shard["name"] for shard in self.shards}
+        for name in os.listdir(self.out_dir):
+            if name.startswith("shard-") and name not in names:
+                os.remove(os.path.join(self.out_dir, name))
+
+    def _open_shard(self):
+        if self.shards and self.shards[-1]["rows"] < self.shard_rows:
+            shard = self.shards[-1]
+        else:
+            shard = {"name": f"shard-{len(self.shards):05d}.csv", "rows": 0, "bytes": 0}
+            self.shards.append(shard)
+        self.file = open(os.path.join(self.out_dir, shard["name"]), 'a', newline='')
+        self.writer = csv.writer(self.file)
+
+    def _write(self, cells, move):
+        if self.file is None:
+            self._open_shard()
+        self.writer.writerow(list(cells) + [move])
+        shard = self.shards[-1]
+        shard["rows"] += 1
+        if shard["rows"] >= self.shard_rows:
+            self._close_shard()
+
+    def _close_shard(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.shards[-1]["bytes"] = self.file.tell()
+            self.file.close()
+            self.file = None
+
+    def add_game(self, rows):
+        """ Writes the rows of one game that were not seen before """
+        for cells, move, key in rows:
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            self._write(cells, move)
+        self.games_done += 1
+
+    def checkpoint(self):
+        """ Makes what was written so far durable and records it in the manifest """
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.shards[-1]["bytes"] = self.file.tell()
+        self.seen.merge()
+        manifest = {"settings": self.settings, "games_done": self.games_done,
+                    "rows": self.rows(), "duplicates": self.duplicates, "shards": self.shards}
+        path = os.path.join(self.out_dir, MANIFEST)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def rows(self):
+        return sum(shard["rows"] for shard in self.shards)
+
+    def run(self, games, workers=None, batch=None):
+        """ Plays games up to a total of games (counting the ones of earlier runs).
+        The manifest is updated after every batch of games """
+        settings = self.settings
+        batch = batch or max(1, 4 * (workers or os.cpu_count() or 1))
+        pool = ProcessPoolExecutor(workers) if workers != 1 else None
+        try:
+            while self.games_done < games:
+                seeds = range(settings["seed"] + self.games_done,
+                              settings["seed"] + min(games, self.games_done + batch))
+                args = (settings["iterations"], settings["c"])
+                if pool is None:
+                    results = (play_game(*args, seed, settings["opening_moves"]) for seed in seeds)
+                else:
+                    futures = [pool.submit(play_game, *args, seed, settings["opening_moves"])
+                               for seed in seeds]
+                    results = (f.result() for f in futures)
+                # in the order of the seeds, so the output does not depend on the workers
+                for rows in results:
+                    self.add_game(rows)
+                self.checkpoint()
+                print(f"{self.games_done}/{games} games, {self.rows()} rows, "
+                      f"{self.duplicates} duplicates")
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self._close_shard()
+            self.checkpoint()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MCTS self-play dataset generator")
+    parser.add_argument("out_dir")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--c", type=float, default=1.41)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--opening-moves", type=int, default=0)
+    parser.add_argument("--shard-rows", type=int, default=100000)
+    parser.add_argument("--bloom", type=int, metavar="CAPACITY",
+                        help="use a Bloom filter sized for CAPACITY rows instead of the exact key set")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    generator = SelfPlayGenerator(args.out_dir, args.iterations, args.c, args.seed, args.shard_rows,
+                                  args.bloom, args.opening_moves)
+    generator.run(args.games, args.workers)
@@ -0,0 +1,296 @@
+""" Game server: many games at the same time over a line-delimited JSON socket.
+
+Each line sent by a client is one request, each line sent back is the response
+(with the same "id" if the request had one):
+
+    {"op": "new", "ai": "mcts:1000:1.41", "human": "x", "first": "x"}
+        -> {"ok": true, "session": "...", "board": [...], "ai_move": null, ...}
+    {"op": "move", "session": "...", "column": 3}
+        -> the human move is played, then the AI reply: {"ok": true, "ai_move": 4, ...}
+    {"op": "ai", "session": "..."}      asks again for an AI move that timed out
+    {"op": "state", "session": "..."}   {"op": "close", "session": "..."}   {"op": "stats"}
+
+The games (a bitboard Position per session) live in the event loop; the AI moves are
+computed by a process pool, so a long search never blocks the other sessions.
+Admission control: at most max_sessions games, at most max_pending AI moves waiting
+for the pool (more are refused with "busy" instead of queueing forever), one request
+at a time per session, and every AI move has timeout_ms to arrive: the MCTS search is
+stopped at that deadline, and a timed out move is not asked for again, op 'ai' waits
+for the one being computed. Idle sessions are closed after idle_timeout seconds.
+
+    python server.py --port 8765 --workers 4
+"""
+import time
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from bitboard import Position, COLORS
+from arena import parse_agent
+
+
+class Session(object):
+
+    def __init__(self, agent, ai_color, first):
+        self.agent = agent
+        self.ai_color = ai_color
+        self.position = Position(first)
+        self.busy = False
+        self.last_active = time.monotonic()
+        # AI move still being computed (after a timeout), awaited again by op 'ai'
+        self.pending_move = None
+
+    def state(self):
+        return {"board": self.position.to_board(), "moves": list(self.position.history),
+                "to_move": self.position.color, "ai": self.agent.name, "ai_color": self.ai_color,
+                "result": self.position.last_move_result() if self.position.history else None}
+
+
+# players of the worker process, one per agent and color (the DT trees are loaded once)
+_players = {}
+
+
+def compute_move(agent, color, history, first, seed, deadline=None):
+    """ Runs in a worker: the AI move for the position after history.
+    deadline (a time.time() value): an MCTS search is stopped then and plays the best
+    move found so far (or a quick move if the job waited in the queue past it), so a move
+    that timed out does not keep the worker busy """
+    random.seed(seed)
+    key = (agent.name, color)
+    player = _players.get(key)
+    if player is None:
+        player = agent.make(color)
+        _players[key] = player
+    position = Position(first)
+    for move in history:
+        position.play(move)
+    if agent.kind == "mcts":
+        return player.move(position.to_board(), True, deadline)
+    return player.move(position.to_board(), True)
+
+
+class GameServer(object):
+
+    def __init__(self, workers=None, max_sessions=10000, max_pending=64, timeout_ms=5000,
+                 idle_timeout=600):
+        self.pool = ProcessPoolExecutor(workers)
+        self.sessions = {}
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.timeout_ms = timeout_ms
+        self.idle_timeout = idle_timeout
+        self.pending = 0
+        self.counters = {"requests": 0, "ai_moves": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+        self.latencies = []     # ms of the last AI moves
+
+    async def ai_move(self, session):
+        """ Asks the pool for the AI move of the session and plays it. After a timeout the
+        move keeps being computed (until the deadline, when the search stops) and the next
+        call waits for that same move instead of asking for a new one """
+        position = session.position
+        future = session.pending_move
+        if future is None:
+            if self.pending >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise ServerError("busy", "too many moves waiting, try again later")
+            loop = asyncio.get_running_loop()
+            first = COLORS[position.to_move ^ (position.moves & 1)]
+            future = loop.run_in_executor(self.pool, compute_move, session.agent, session.ai_color,
+                                          list(position.history), first, random.getrandbits(32),
+                                          time.time() + self.timeout_ms / 1000)
+            # a move that timed out still uses a worker until it ends, so it stays pending until then
+            self.pending += 1
+            future.add_done_callback(self.move_done)
+            session.pending_move = future
+        start = time.perf_counter()
+        try:
+            move = await asyncio.wait_for(asyncio.shield(future), self.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise ServerError("timeout", f"no move after {self.timeout_ms} ms, ask again with op 'ai'")
+        finally:
+            if future.done():
+                session.pending_move = None
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        del self.latencies[:-1000]
+        self.counters["ai_moves"] += 1
+        if not position.can_play(move):
+            move = random.choice(position.legal_moves())
+        position.play(move)
+        return move
+
+    def move_done(self, future):
+        self.pending -= 1
+
+    async def op_new(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            self.counters["rejected"] += 1
+            raise ServerError("full", "no more sessions allowed")
+        try:
+            agent = parse_agent(request.get("ai", "mcts:1000:1.41"))
+        except ValueError as e:
+            raise ServerError("bad_request", str(e))
+        human = request.get("human", "x")
+        first = request.get("first", "x")
+        if human not in COLORS or first not in COLORS:
+            raise ServerError("bad_request", "colors are 'x' and 'o'")
+        session = Session(agent, COLORS[COLORS.index(human) ^ 1], first)
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session
+        ai_move = None
+        if first == session.ai_color:
+            try:
+                ai_move = await self.locked(session, self.ai_move(session))
+            except ServerError:
+                # the client never got the session id, so the session is not kept
+                del self.sessions[session_id]
+                raise
+        return dict(session.state(), session=session_id, ai_move=ai_move)
+
+    async def op_move(self, request):
+        session = self.get_session(request)
+        position = session.position
+        column = request.get("column")
+        if position.history and position.last_move_result() is not None:
+            raise ServerError("finished", "the game is over")
+        if position.color == session.ai_color:
+            raise ServerError("not_your_turn", "waiting for the AI move")
+        if not isinstance(column, int) or not 0 <= column < 7 or not position.can_play(column):
+            raise ServerError("bad_move", f"column {column!r} can not be played")
+
+        async def play():
+            position.play(column)
+            if position.last_move_result() is None:
+                return await self.ai_move(session)
+            return None
+        ai_move = await self.locked(session, play())
+        return dict(session.state(), ai_move=ai_move)
+
+    async def op_ai(self, request):
+        """ Asks again for the AI move (after a timeout) """
+        session = self.get_session(request)
+        position = session.position
+        if position.history and position.last_move_result() is not None:
+            raise ServerError("finished", "the game is over")
+        if position.color != session.ai_color:
+            raise ServerError("not_ai_turn", "it is the human's turn")
+        ai_move = await self.locked(session, self.ai_move(session))
+        return dict(session.state(), ai_move=ai_move)
+
+    async def op_state(self, request):
+        return self.get_session(request).state()
+
+    async def op_close(self, request):
+        self.get_session(request)
+        del self.sessions[request["session"]]
+        return {}
+
+    async def op_stats(self, request):
+        latencies = sorted(self.latencies)
+        return dict(self.counters, sessions=len(self.sessions), pending=self.pending,
+                    latency_ms_avg=sum(latencies) / len(latencies) if latencies else 0.0,
+                    latency_ms_p95=latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0)
+
+    def get_session(self, request):
+        session = self.sessions.get(request.get("session"))
+        if session is None:
+            raise ServerError("no_session", "unknown session")
+        session.last_active = time.monotonic()
+        return session
+
+    async def locked(self, session, coroutine):
+        """ One request at a time per session """
+        if session.busy:
+            coroutine.close()
+            raise ServerError("busy", "the session is already handling a request")
+        session.busy = True
+        try:
+            return await coroutine
+        finally:
+            session.busy = False
+            session.last_active = time.monotonic()
+
+    async def dispatch(self, line):
+        self.counters["requests"] += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ServerError("bad_request", "a request is a JSON object")
+            request_id = request.get("id")
+            handler = getattr(self, "op_" + str(request.get("op")), None)
+            if handler is None:
+                raise ServerError("bad_request", f"unknown op {request.get('op')!r}")
+            response = dict(await handler(request), ok=True)
+        except ServerError as e:
+            response = {"ok": False, "error": e.code, "message": e.message}
+        except ValueError as e:
+            response = {"ok": False, "error": "bad_request", "message": str(e)}
+        except Exception as e:
+            self.counters["errors"] += 1
+            response = {"ok": False, "error": "internal", "message": repr(e)}
+        if request_id is not None:
+            response["id"] = request_id
+        return response
+
+    async def handle_client(self, reader, writer):
+        """ The requests of one connection are answered in order """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.dispatch(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def reap_sessions(self):
+        """ Closes the sessions with no request for idle_timeout seconds """
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if not session.busy and now - session.last_active > self.idle_timeout:
+                    del self.sessions[session_id]
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        reaper = asyncio.ensure_future(self.reap_sessions())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+
+class ServerError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connect 4 game server (line-delimited JSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--timeout-ms", type=int, default=5000)
+    parser.add_argument("--idle-timeout", type=int, default=600)
+    args = parser.parse_args()
+
+    game_server = GameServer(args.workers, args.max_sessions, args.max_pending, args.timeout_ms,
+                             args.idle_timeout)
+    print(f"listening on {args.host}:{args.port}")
+    asyncio.run(game_server.serve(args.host, args.port))
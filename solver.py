@@ -0,0 +1,143 @@
+""" Exact solver for the end of the game.
+
+Negamax with alpha-beta on the bitboard Position, only for the outcome: 1 if the
+player to move wins, 0 for a draw, -1 if they lose (a window of (-1, 1) prunes much
+more than exact scores). Moves that win at once, forced blocks and moves that let the
+opponent win at once are handled before searching, the rest are tried from the
+center out, and the results are kept in a transposition table with bound flags.
+With about 12-14 empty cells a position is solved in milliseconds to a second.
+"""
+import time
+from bitboard import ROWS, COLS, H1, WINDOWS
+
+# columns from the center out: the center moves are usually the best ones
+MOVE_ORDER = (3, 2, 4, 1, 5, 0, 6)
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SolverTimeout(Exception):
+    """ Raised by the search when the deadline of the solver has passed """
+
+
+def _wins_at(mask, bit):
+    """ True if a piece on bit would make 4 in a row with mask """
+    m = mask | (1 << bit)
+    for window in WINDOWS[bit]:
+        if m & window == window:
+            return True
+    return False
+
+
+class Solver(object):
+    """ Weak solver (win/draw/loss) with a transposition table of at most capacity entries """
+
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.table = {}
+        self.nodes = 0
+        # time.perf_counter() value: past it solve and best_move raise SolverTimeout
+        # (checked every 4096 nodes; the entries already in the table stay valid)
+        self.deadline = None
+
+    def clear(self):
+        self.table.clear()
+
+    def solve(self, position):
+        """ 1, 0 or -1 for the player to move. position is left unchanged """
+        return self.negamax(position, -1, 1)
+
+    def best_move(self, position):
+        """ (move, value) of the best move for the player to move: a winning move if there
+        is one, else a drawing one, else the move that loses (the first one in MOVE_ORDER) """
+        best = None
+        best_value = -2
+        for col in MOVE_ORDER:
+            if not position.can_play(col):
+                continue
+            position.play(col)
+            if position.last_move_won():
+                value = 1
+            else:
+                value = -self.negamax(position, -1, -best_value if best_value > -2 else 1)
+            position.undo()
+            if value > best_value:
+                best, best_value = col, value
+                if value == 1:
+                    break
+        return best, best_value
+
+    def negamax(self, position, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 4095 == 0 and self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SolverTimeout()
+        moves = position.moves
+        if moves == ROWS * COLS:
+            return 0
+        me = position.masks[position.to_move]
+        opponent = position.masks[position.to_move ^ 1]
+        heights = position.heights
+
+        playable = []
+        threats = []
+        for col in MOVE_ORDER:
+            bit = heights[col]
+            if bit - col * H1 < ROWS:
+                if _wins_at(me, bit):
+                    return 1
+                if _wins_at(opponent, bit):
+                    threats.append(col)
+                playable.append(col)
+        if len(threats) > 1:
+            # two places to block
+            return -1
+        if moves == ROWS * COLS - 1:
+            return 0
+        if threats:
+            playable = threats
+
+        # a move right below a winning cell of the opponent gives them the win
+        safe = []
+        for col in playable:
+            above = heights[col] + 1
+            if above - col * H1 < ROWS and _wins_at(opponent, above):
+                continue
+            safe.append(col)
+        if not safe:
+            return -1
+
+        key = position.key()
+        entry = self.table.get(key)
+        if entry is not None:
+            value, flag = entry
+            if flag == EXACT:
+                return value
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        original_alpha = alpha
+        best = -1
+        for col in safe:
+            position.play(col)
+            value = -self.negamax(position, -beta, -alpha)
+            position.undo()
+            if value > best:
+                best = value
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+
+        if len(self.table) >= self.capacity:
+            self.table.clear()
+        if best <= original_alpha:
+            self.table[key] = (best, UPPER)
+        elif best >= beta:
+            self.table[key] = (best, LOWER)
+        else:
+            self.table[key] = (best, EXACT)
+        return best
@@ -0,0 +1,87 @@
+""" The histogram split search (user-009) must build the same tree as the original ID3,
+which sliced a DataFrame for every candidate pair of thresholds. """
+import os
+from collections import Counter
+import numpy as np
+import pandas as pd
+from compiled_tree import CELL_FEATURES
+from dataset_io import load_dataset
+from decision_tree_model import DATASETS, build_tree_arrays, build_tree_two_thresholds, entropy
+
+
+def reference_two_splits(data, features):
+    """ find_best_two_splits as it was before the histograms """
+    best_gain = 0
+    best_feature = None
+    best_thresholds = (None, None)
+    for feature in features:
+        sorted_values = sorted(data[feature].unique())
+        thresholds = [(sorted_values[i] + sorted_values[i + 1]) / 2 for i in range(len(sorted_values) - 1)]
+        for i in range(len(thresholds)):
+            for j in range(i + 1, len(thresholds)):
+                t1 = thresholds[i]
+                t2 = thresholds[j]
+                left = data[data[feature] <= t1]
+                middle = data[(data[feature] > t1) & (data[feature] <= t2)]
+                right = data[data[feature] > t2]
+                total_entropy = entropy(data['label'].values)
+                weighted_entropy = (
+                    len(left) / len(data) * entropy(left['label'].values) +
+                    len(middle) / len(data) * entropy(middle['label'].values) +
+                    len(right) / len(data) * entropy(right['label'].values)
+                )
+                gain = total_entropy - weighted_entropy
+                if gain > best_gain:
+                    best_gain = gain
+                    best_feature = feature
+                    best_thresholds = (t1, t2)
+    return best_feature, best_thresholds
+
+
+def reference_tree(data, features, max_depth, min_samples, depth=0):
+    """ build_tree_two_thresholds as it was before the histograms """
+    labels = data['label']
+    if len(set(labels)) == 1 or len(features) == 0 or len(data) < min_samples or depth >= max_depth:
+        return Counter(labels).most_common(1)[0][0]
+    best_feature, (t1, t2) = reference_two_splits(data, features)
+    if best_feature is None or t1 is None or t2 is None:
+        return Counter(labels).most_common(1)[0][0]
+    left_data = data[data[best_feature] <= t1]
+    middle_data = data[(data[best_feature] > t1) & (data[best_feature] <= t2)]
+    right_data = data[data[best_feature] > t2]
+    if len(left_data) == 0 or len(middle_data) == 0 or len(right_data) == 0:
+        return Counter(labels).most_common(1)[0][0]
+    new_features = [f for f in features if f != best_feature]
+    tree = {best_feature: {}}
+    tree[best_feature]['<= ' + str(t1)] = reference_tree(left_data, new_features, max_depth, min_samples,
+                                                         depth + 1)
+    tree[best_feature]['(' + str(t1) + ', ' + str(t2) + ']'] = reference_tree(
+        middle_data, new_features, max_depth, min_samples, depth + 1)
+    tree[best_feature]['> ' + str(t2)] = reference_tree(right_data, new_features, max_depth, min_samples,
+                                                        depth + 1)
+    return tree
+
+
+def test_same_tree_as_id3_on_random_data():
+    rng = np.random.default_rng(0)
+    features = [f"f{i}" for i in range(5)]
+    X = rng.integers(0, 5, size=(150, len(features)))
+    # labels that depend on the features, so the tree is more than one leaf
+    y = (X[:, 0] + X[:, 2] // 2 + rng.integers(0, 2, size=len(X))) % 4
+    data = pd.DataFrame(X, columns=features)
+    data['label'] = y
+    expected = reference_tree(data, features, max_depth=4, min_samples=5)
+    assert isinstance(expected, dict)
+    assert build_tree_two_thresholds(data, features, max_depth=4, min_samples=5) == expected
+    assert build_tree_arrays(X, y, features, max_depth=4, min_samples=5) == expected
+
+
+def test_same_tree_as_id3_on_boards():
+    boards, labels = load_dataset(os.path.join(os.path.dirname(__file__), "..", DATASETS["easy"]))
+    X = np.asarray(boards)[:300]
+    y = np.asarray(labels)[:300]
+    data = pd.DataFrame(X, columns=CELL_FEATURES)
+    data['label'] = y
+    expected = reference_tree(data, CELL_FEATURES, max_depth=5, min_samples=5)
+    assert isinstance(expected, dict)
+    assert build_tree_arrays(X, y, CELL_FEATURES, max_depth=5, min_samples=5) == expected
@@ -0,0 +1,50 @@
+""" Updates of an IncrementalTree (user-025) give the tree of a full training on all the rows. """
+import os
+import numpy as np
+from compiled_tree import CELL_FEATURES, canonical_dataset
+from dataset_io import load_dataset
+from decision_tree_model import DATASETS, build_tree_arrays
+from incremental_tree import IncrementalTree
+
+
+def load(difficulty):
+    boards, labels = load_dataset(os.path.join(os.path.dirname(__file__), "..", DATASETS[difficulty]))
+    return np.asarray(boards), np.asarray(labels)
+
+
+def full_tree(batches, canonical):
+    X = np.concatenate([X for X, _ in batches])
+    y = np.concatenate([y for _, y in batches])
+    if canonical:
+        X, y = canonical_dataset(X, y)
+    return build_tree_arrays(X, y, CELL_FEATURES)
+
+
+def check_updates(batches, canonical):
+    model = IncrementalTree(*batches[0], drift=0.0, canonical=canonical)
+    stats = []
+    for i in range(1, len(batches)):
+        stats.append(model.update(*batches[i]))
+        assert model.tree() == full_tree(batches[:i + 1], canonical)
+    return stats
+
+
+def test_updates_match_full_training():
+    X, y = load("hard")
+    bounds = [0, 2000, 2300, 2350, 2700, 3000]
+    batches = [(X[a:b], y[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+    stats = check_updates(batches, canonical=True)
+    # the small batches only rebuild parts of the tree
+    assert not all(s["full_rebuild"] for s in stats)
+
+
+def test_new_label_rebuilds_everything():
+    X, y = load("medium")
+    X, y = X[:2500], y[:2500]
+    seen = y != 6
+    # the first batches never play column 6, the last one does
+    batches = [(X[seen][:1500], y[seen][:1500]), (X[seen][1500:1700], y[seen][1500:1700]),
+               (X[~seen], y[~seen])]
+    stats = check_updates(batches, canonical=False)
+    assert not stats[0]["full_rebuild"]
+    assert stats[1]["full_rebuild"]
@@ -0,0 +1,75 @@
+""" The exact solver and the MCTS-Solver proofs (user-020) against an exhaustive negamax. """
+import random
+from bitboard import Position, ROWS, COLS
+from mcts import MCTS
+from solver import Solver
+
+
+def exhaustive(position, memo):
+    """ 1, 0 or -1 for the player to move, by trying every move (no pruning) """
+    if position.moves == ROWS * COLS:
+        return 0
+    key = (position.key(), position.to_move)
+    if key not in memo:
+        best = -1
+        for col in position.legal_moves():
+            position.play(col)
+            value = 1 if position.last_move_won() else -exhaustive(position, memo)
+            position.undo()
+            best = max(best, value)
+        memo[key] = best
+    return memo[key]
+
+
+def random_position(rng, empty):
+    """ A random unfinished position with empty cells left """
+    while True:
+        position = Position()
+        while ROWS * COLS - position.moves > empty:
+            position.play(rng.choice(position.legal_moves()))
+            if position.last_move_result() is not None:
+                break
+        else:
+            return position
+
+
+def test_solve_matches_exhaustive_negamax():
+    rng = random.Random(0)
+    solver = Solver()
+    memo = {}
+    values = set()
+    for _ in range(150):
+        position = random_position(rng, rng.randint(4, 10))
+        history = list(position.history)
+        expected = exhaustive(position, memo)
+        assert solver.solve(position) == expected
+        assert solver.best_move(position)[1] == expected
+        assert list(position.history) == history
+        values.add(expected)
+    # wins, draws and losses were all checked
+    assert values == {-1, 0, 1}
+
+
+def test_mcts_solver_proofs_match_exhaustive_negamax():
+    rng = random.Random(1)
+    memo = {}
+    proofs = 0
+    for _ in range(20):
+        position = random_position(rng, 12)
+        random.seed(rng.getrandbits(32))
+        mc = MCTS(None, 2000, solver_threshold=6)
+        player = position.color
+        root = mc.new_root(position, player)
+        mc.search(root, position, player, 2000)
+        # proven is the result for the player who moved into the node
+        if root.proven is not None:
+            assert root.proven == -exhaustive(position, memo)
+            proofs += 1
+        for move, child in zip(root.child_moves, root.children):
+            if child.proven is not None:
+                position.play(move)
+                expected = 1 if position.last_move_won() else -exhaustive(position, memo)
+                position.undo()
+                assert child.proven == expected
+                proofs += 1
+    assert proofs > 0
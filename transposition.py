@@ -0,0 +1,66 @@
+""" Transposition table for MCTS.
+
+In Connect 4 the same position is very often reached with the moves in a different
+order. The table maps the key of a position to its MCTS node, so all the paths that
+reach a position share one node (and its visits and wins), turning the tree into a DAG.
+
+The board is left-right symmetric, so with symmetric=True (the default) a position and
+its mirror image also share one node: the key is Position.canonical_key(), and MCTS
+plays the moves of a node mirrored when it reaches it from the mirror image of the
+position it was created from (see Node.mirrored).
+"""
+from collections import OrderedDict
+
+
+class TranspositionTable(object):
+    """ Position key -> node, with at most capacity entries.
+    When full, the least recently used entry is evicted (the node itself stays in the
+    tree while it is referenced, it just stops being shared) """
+
+    def __init__(self, capacity=1000000, symmetric=True):
+        self.capacity = capacity
+        self.symmetric = symmetric
+        self.entries = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def position_key(self, position):
+        """ (key, mirrored): mirrored is True when the key is the one of the mirror image.
+        Position.key() does not say which color is to move, so it is added here """
+        if self.symmetric:
+            key, mirrored = position.canonical_key()
+        else:
+            key, mirrored = position.key(), False
+        return key * 2 + position.to_move, mirrored
+
+    def get(self, key):
+        self.lookups += 1
+        node = self.entries.get(key)
+        if node is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return node
+
+    def put(self, key, node):
+        self.entries[key] = node
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        """ Counters since the table was created, to see how much work is shared """
+        return {"size": len(self.entries), "capacity": self.capacity,
+                "lookups": self.lookups, "hits": self.hits,
+                "hit_rate": self.hit_rate(), "evictions": self.evictions,
+                "symmetric": self.symmetric}
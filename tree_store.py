@@ -0,0 +1,79 @@
+""" Array-backed storage for the MCTS tree (struct of arrays).
+
+Instead of one Python object per node, node i is the i-th entry of a few flat
+arrays. The children of a node are stored next to each other, first_child[i] is
+the index of the first one and num_children[i] how many there are. No board is
+stored: the search rebuilds the position by playing the moves of the path.
+A node takes 22 bytes, so millions of nodes fit in a few tens of MB.
+"""
+from array import array
+
+NO_NODE = -1
+
+
+class TreeStore(object):
+    """ Preallocated arrays for the nodes of one search.
+    They grow (doubling) when full and clear() reuses them for the next search """
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = 0
+        self.size = 0
+        self.visits = array('i')
+        self.wins = array('d')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.num_children = array('b')  # 0 while the node is not expanded
+        self.move = array('b')          # column played to reach the node
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """ Makes room for at least capacity nodes """
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        self.visits.extend(array('i', [0]) * extra)
+        self.wins.extend(array('d', [0.0]) * extra)
+        self.parent.extend(array('i', [NO_NODE]) * extra)
+        self.first_child.extend(array('i', [NO_NODE]) * extra)
+        self.num_children.extend(array('b', [0]) * extra)
+        self.move.extend(array('b', [-1]) * extra)
+        self.capacity = capacity
+
+    def clear(self):
+        """ Forgets every node; the buffers are kept for the next search """
+        self.size = 0
+
+    def add_root(self):
+        self.clear()
+        return self._new_nodes(NO_NODE, [-1])
+
+    def expand(self, node, moves):
+        """ Creates one child (with no visits) per move, stored next to each other """
+        first = self._new_nodes(node, moves)
+        self.first_child[node] = first
+        self.num_children[node] = len(moves)
+        return first
+
+    def _new_nodes(self, parent, moves):
+        first = self.size
+        end = first + len(moves)
+        if end > self.capacity:
+            self.grow(max(end, 2 * self.capacity))
+        for index, move in enumerate(moves, first):
+            self.visits[index] = 0
+            self.wins[index] = 0.0
+            self.parent[index] = parent
+            self.first_child[index] = NO_NODE
+            self.num_children[index] = 0
+            self.move[index] = move
+        self.size = end
+        return first
+
+    def children(self, node):
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node])
+
+    def nbytes(self):
+        """ Memory used by the buffers """
+        return sum(a.itemsize * len(a) for a in (self.visits, self.wins, self.parent,
+                                                 self.first_child, self.num_children, self.move))